@@ -1,18 +1,43 @@
+import time
+# Start of the startup report, taken before the imports it measures
+STARTED = time.perf_counter()
+
 import pygame
 import os
+import random
 
-from models import ScreenEngine as SE, Logic, Service, Objects
+from models import ScreenEngine as SE, Service, Environment, Profiler, Replay, Assets
 
 SCREEN_DIM = (800, 600)
-
-pygame.init()
-gameDisplay = pygame.display.set_mode(SCREEN_DIM)
-pygame.display.set_caption("MyRPG")
 KEYBOARD_CONTROL = True
-
-if not KEYBOARD_CONTROL:
-    import numpy as np
-    answer = np.zeros(4, dtype=float)
+# 'events' sleeps until input, 'capped' runs at most FPS frames per second,
+# 'uncapped' runs as fast as possible (benchmarks)
+LOOP_MODE = 'events'
+FPS = 30
+# Per frame profiling of drawing chain, F3 shows percentiles, dumped at exit
+PROFILE = False
+PROFILE_FILE = 'profile.json'
+# Fixed seed replays the same session, games get seeds drawn from it
+SEED = None
+# Action log of the session is saved there at exit, see models/Replay.py
+ACTION_LOG = None
+# Number of levels generated ahead on a worker thread
+LEVEL_POOL_DEPTH = 2
+# Prints time of startup phases after the first frame
+STARTUP_REPORT = False
+# Zoom steps each way whose sprites are scaled ahead on a worker thread
+ZOOM_PREFETCH = 2
+
+KEY_COMMANDS = {
+    pygame.K_RIGHT: Replay.MOVE_RIGHT,
+    pygame.K_LEFT: Replay.MOVE_LEFT,
+    pygame.K_UP: Replay.MOVE_UP,
+    pygame.K_DOWN: Replay.MOVE_DOWN,
+    pygame.K_KP_PLUS: Replay.ZOOM_IN,
+    pygame.K_KP_MINUS: Replay.ZOOM_OUT,
+    pygame.K_r: Replay.RESTART,
+    pygame.K_h: Replay.HELP
+}
 
 base_stats = {
     "strength": 20,
@@ -22,16 +47,23 @@ base_stats = {
 }
 
 
-def create_game(sprite_size, is_new, hero_sprite_name=None):
-    if hero_sprite_name is None:
-        hero_sprite_name = 'Hero_right.png'
+def load_hero_sprites(sprite_size):
+    global hero_sprites
+    hero_sprites = {
+        name: Service.create_sprite(os.path.join("texture", name), sprite_size)
+        for name in ('Hero_left.png', 'Hero_right.png')
+    }
+
+
+def turn_hero(hero_sprite_name):
+    hero.sprite = hero_sprites[hero_sprite_name]
+
+
+def create_game(sprite_size, is_new):
     global hero, engine, drawer, iteration
+    load_hero_sprites(sprite_size)
     if is_new:
-        hero = Objects.Hero(base_stats, Service.create_sprite(
-            os.path.join("texture", 'Hero_right.png'), sprite_size))
-        engine = Logic.GameEngine()
-        Service.service_init(sprite_size)
-        Service.reload_game(engine, hero)
+        hero, engine = session.env.hero, session.engine
         # with ScreenEngine as SE:
         drawer = SE.GameSurface((640, 480), pygame.SRCALPHA, (0, 480),
                                 SE.ProgressBar((640, 120), (640, 0),
@@ -40,92 +72,140 @@ def create_game(sprite_size, is_new, hero_sprite_name=None):
                                                                            SE.ScreenHandle(
                                                                                (0, 0))
                                                                            ))))
+        # Chunks of terrain are drawn on a worker after zoom
+        drawer.stand_ins = True
+        profiler.attach(drawer)
 
-    else:
-        engine.sprite_size = sprite_size
-        hero.sprite = Service.create_sprite(
-            os.path.join("texture", hero_sprite_name), sprite_size
-        )
-        Service.service_init(sprite_size, False)
-
-    Logic.GameEngine.sprite_size = sprite_size
+    engine.sprite_size = sprite_size
+    Service.load_textures(sprite_size)
+    turn_hero(session.facing)
 
     drawer.connect_engine(engine)
+    Assets.manager.prefetch([sprite_size + 2 * step
+                             for step in range(-ZOOM_PREFETCH, ZOOM_PREFETCH + 1)
+                             if step and sprite_size + 2 * step > 0])
 
     iteration = 0
 
 
-size = 60
-create_game(size, True)
-
-while engine.working:
-
-    if KEYBOARD_CONTROL:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                engine.working = False
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_h:
-                    engine.show_help = not engine.show_help
-                if event.key == pygame.K_KP_PLUS:
-                    if 640 // size > 5:
-                        size = size + 2
-                        create_game(size, False)
-                    else:
-                        engine.notify('Min Size reached')
-                if event.key == pygame.K_KP_MINUS:
-                    if 640 // size < 30:
-                        size = size - 2
-                        create_game(size, False)
-                    else:
-                        engine.notify('Max Size reached')
-                if event.key == pygame.K_r:
-                    create_game(size, True)
-                if event.key == pygame.K_ESCAPE:
-                    engine.working = False
-                if engine.game_process:
-                    if event.key == pygame.K_UP:
-                        engine.move_up()
-                        iteration += 1
-                    elif event.key == pygame.K_DOWN:
-                        engine.move_down()
-                        iteration += 1
-                    elif event.key == pygame.K_LEFT:
-                        engine.move_left()
-                        iteration += 1
-                        create_game(size, False, 'Hero_left.png')
-                    elif event.key == pygame.K_RIGHT:
-                        engine.move_right()
-                        iteration += 1
-                        create_game(size, False, 'Hero_right.png')
+def run_command(command):
+    ''' Applies command to the session, updates the screen for it.'''
+    global iteration
+    games, size = session.games, session.sprite_size
+    session.apply(command)
+    if session.games != games:
+        create_game(session.sprite_size, True)
+    elif session.sprite_size != size:
+        create_game(session.sprite_size, False)
+    elif command in (Replay.MOVE_LEFT, Replay.MOVE_RIGHT):
+        iteration += 1
+        turn_hero(session.facing)
+    elif command in (Replay.MOVE_UP, Replay.MOVE_DOWN):
+        iteration += 1
+
+
+def main():
+    global gameDisplay, profiler, session
+    startup = Profiler.StartupReport(STARTED) if STARTUP_REPORT else None
+    if startup:
+        startup.phase('imports')
+    pygame.init()
+    gameDisplay = pygame.display.set_mode(SCREEN_DIM)
+    pygame.display.set_caption("MyRPG")
+    if startup:
+        startup.phase('display')
+
+    profiler = Profiler.FrameProfiler() if PROFILE else Profiler.NullProfiler()
+    Service.service_init(None)
+    if startup:
+        startup.phase('config')
+    session = Replay.Session(SEED, 60, base_stats, LEVEL_POOL_DEPTH)
+    # Moves of automated mode, games of session have their own seeds
+    policy = random.Random(session.seed)
+    if startup:
+        startup.phase('first level')
+    create_game(session.sprite_size, True)
+    if startup:
+        startup.phase('textures')
+    clock = pygame.time.Clock()
+    redraw = True
+
+    while engine.working:
+
+        if KEYBOARD_CONTROL:
+            if LOOP_MODE == 'events' and not redraw:
+                if drawer.waiting:
+                    # Polls to show terrain chunks drawn on the worker,
+                    # event.wait() of pygame 1.9 has no timeout
+                    clock.tick(50)
+                    events = pygame.event.get()
                 else:
-                    if event.key == pygame.K_RETURN:
-                        create_game()
-    else:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                engine.working = False
-        if engine.game_process:
-            actions = [
-                engine.move_right,
-                engine.move_left,
-                engine.move_up,
-                engine.move_down,
-            ]
-            answer = np.random.randint(0, 100, 4)
-            prev_score = engine.score
-            move = actions[np.argmax(answer)]()
-            state = pygame.surfarray.array3d(gameDisplay)
-            reward = engine.score - prev_score
-            print(reward)
+                    events = [pygame.event.wait()] + pygame.event.get()
+            else:
+                events = pygame.event.get()
+            if drawer.waiting:
+                redraw = True
+            profiler.start('input')
+            for event in events:
+                if event.type == pygame.QUIT:
+                    engine.working = False
+                if event.type == pygame.VIDEOEXPOSE:
+                    pygame.display.update()
+                if event.type == pygame.KEYDOWN:
+                    redraw = True
+                    if event.key == pygame.K_F3 and PROFILE:
+                        profiler.overlay = not profiler.overlay
+                        drawer.invalidate()
+                    if event.key == pygame.K_ESCAPE:
+                        engine.working = False
+                    command = KEY_COMMANDS.get(event.key)
+                    if event.key == pygame.K_RETURN and not engine.game_process:
+                        command = Replay.RESTART
+                    if command is not None:
+                        run_command(command)
         else:
-            create_game()
-
-    gameDisplay.blit(drawer, (0, 0))
-    drawer.draw(gameDisplay)
-
-    pygame.display.update()
-
-pygame.display.quit()
-pygame.quit()
-exit(0)
+            profiler.start('input')
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    engine.working = False
+            redraw = True
+            if not session.env.done:
+                # actions are ordered as Environment.ACTIONS
+                score = engine.score
+                run_command(policy.randrange(len(Environment.ACTIONS)))
+                print(engine.score - score)
+            elif engine.working:
+                run_command(Replay.RESTART)
+        profiler.stop('input')
+
+        if redraw:
+            profiler.start('compose')
+            rects = drawer.compose(gameDisplay)
+            profiler.stop('compose')
+            rects += profiler.draw_overlay(gameDisplay)
+            profiler.start('update')
+            if rects:
+                pygame.display.update(rects)
+            profiler.stop('update')
+            profiler.end_frame()
+            redraw = False
+            if startup:
+                startup.phase('first frame')
+                print(startup.report())
+                startup = None
+
+        if LOOP_MODE == 'capped':
+            clock.tick(FPS)
+
+    if PROFILE:
+        profiler.dump(PROFILE_FILE)
+    if ACTION_LOG:
+        session.save(ACTION_LOG)
+    Service.close_level_pool()
+    pygame.display.quit()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
+    exit(0)
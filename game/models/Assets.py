@@ -0,0 +1,119 @@
+import collections
+
+
+def decode_image(img):
+    # pygame is imported here so the headless game logic does not need it
+    import pygame
+
+    icon = pygame.image.load(img)
+    # convert_alpha needs a video mode, headless runs keep the raw image
+    if pygame.display.get_surface() is not None:
+        icon = icon.convert_alpha()
+    return icon
+
+
+def scale_sprite(icon, sprite_size):
+    import pygame
+
+    icon = pygame.transform.scale(icon, (sprite_size, sprite_size))
+    sprite = pygame.Surface((sprite_size, sprite_size), pygame.HWSURFACE)
+    sprite.blit(icon, (0, 0))
+    return sprite
+
+
+def scale_all(keys, images):
+    return {(img, size): scale_sprite(images[img], size) for img, size in keys}
+
+
+class AssetManager:
+    """ LRU cache of scaled sprites keyed by (path, sprite_size).
+
+    Decoded images are kept, so a sprite of a new size is only scaled
+    from them. prefetch() scales sprites of coming sizes on a worker
+    thread; the worker only returns them, they are merged into the cache
+    by the next lookup on the main thread.
+    """
+
+    def __init__(self, max_sprites=256):
+        self.max_sprites = max_sprites
+        self.sprites = collections.OrderedDict()
+        self.images = {}
+        self.pending = []
+        self.executor = None
+
+    def store(self, key, sprite):
+        self.sprites[key] = sprite
+        while len(self.sprites) > self.max_sprites:
+            self.sprites.popitem(last=False)
+
+    def collect(self):
+        ''' Merges sprites scaled by the worker, keeping cached ones.'''
+        for future in [future for future in self.pending if future.done()]:
+            self.pending.remove(future)
+            if future.cancelled():
+                continue
+            for key, sprite in future.result().items():
+                if key not in self.sprites:
+                    self.store(key, sprite)
+
+    def get_sprite(self, img, sprite_size):
+        if self.pending:
+            self.collect()
+        key = (img, sprite_size)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            return sprite
+
+        image = self.images.get(img)
+        if image is None:
+            image = self.images[img] = decode_image(img)
+        sprite = scale_sprite(image, sprite_size)
+        self.store(key, sprite)
+        return sprite
+
+    def prefetch(self, sizes):
+        ''' Scales sprites of every decoded image to sizes on a worker.'''
+        if self.executor is None:
+            import concurrent.futures
+
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Sizes asked for before are not needed any more
+        for future in self.pending:
+            future.cancel()
+        keys = [(img, size) for size in sizes for img in self.images
+                if (img, size) not in self.sprites]
+        self.pending.append(self.executor.submit(scale_all, keys, dict(self.images)))
+
+    def clear(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending = []
+        self.sprites.clear()
+        self.images.clear()
+
+
+class SpriteHolder:
+    """ Sprite of a texture at the size set by resize(), loaded at the
+    first holder[0] lookup, so textures of objects which are not drawn
+    are never decoded."""
+
+    def __init__(self, texture):
+        self.texture = texture
+        self.sprite_size = None
+        self.sprite = None
+
+    def resize(self, sprite_size):
+        if sprite_size != self.sprite_size:
+            self.sprite_size = sprite_size
+            self.sprite = None
+
+    def __getitem__(self, index):
+        if index != 0:
+            raise IndexError(index)
+        if self.sprite is None:
+            self.sprite = manager.get_sprite(self.texture, self.sprite_size)
+        return self.sprite
+
+
+manager = AssetManager()
@@ -0,0 +1,247 @@
+import numpy as np
+
+from models import Chunks, Objects, Service
+from models.Environment import BASE_STATS
+
+STATS = ('strength', 'endurance', 'intelligence', 'luck')
+STRENGTH, ENDURANCE, INTELLIGENCE, LUCK = range(4)
+
+# Kinds of objects in object tables
+NONE, ENEMY, STAIRS, CHEST, BLESS, REMOVE, HEAL = range(7)
+ACTION_KINDS = {'reload_game': STAIRS,
+                'add_gold': CHEST,
+                'apply_blessing': BLESS,
+                'remove_effect': REMOVE,
+                'restore_hp': HEAL}
+
+# Move deltas (dx, dy) in order of Environment.ACTIONS
+MOVES = np.array([[1, 0], [-1, 0], [0, -1], [0, 1]])
+
+
+class BatchEnvironment:
+    """ N independent dungeons stepped together with NumPy.
+
+    State of every dungeon is a row of stacked arrays: wall grids, hero
+    position and stats, and object tables indexed through `object_grid`.
+    Movement, pickups and combat follow GameEngine, Service actions and
+    Enemy.interact, but are computed for all dungeons at once. Python
+    code runs per dungeon only on level change and reset.
+    Finished dungeons are reset automatically, so the observation
+    returned for them is the first one of a new episode.
+    """
+
+    def __init__(self, n, base_stats=None, max_steps=None,
+                 map_shape=(41, 41), max_objects=64):
+        self.n = n
+        self.base_stats = base_stats if base_stats is not None else BASE_STATS
+        self.max_steps = max_steps
+        self.rng = np.random.default_rng()
+        if not hasattr(Service, 'level_list'):
+            Service.service_init(None)
+
+        height, width = map_shape
+        self.walls = np.ones((n, height, width), dtype=bool)
+        self.object_grid = np.full((n, height, width), -1, dtype=np.int16)
+        self.object_kind = np.zeros((n, max_objects), dtype=np.int8)
+        self.object_stats = np.zeros((n, max_objects, len(STATS)))
+        self.object_exp = np.zeros((n, max_objects), dtype=np.int64)
+
+        self.position = np.ones((n, 2), dtype=np.int64)
+        self.stats = np.zeros((n, len(STATS)))
+        self.hp = np.zeros(n, dtype=np.int64)
+        self.max_hp = np.zeros(n, dtype=np.int64)
+        self.exp = np.zeros(n, dtype=np.int64)
+        self.gold = np.zeros(n, dtype=np.int64)
+        self.level = np.ones(n, dtype=np.int64)
+        self.effects = np.zeros(n, dtype=np.int64)
+        self.floor = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n)
+        self.working = np.ones(n, dtype=bool)
+        self.steps = np.zeros(n, dtype=np.int64)
+
+    # EPISODES
+    def reset(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.reset_envs(np.arange(self.n))
+        return self.observe()
+
+    def reset_envs(self, indices):
+        base = np.array([self.base_stats[name] for name in STATS], dtype=float)
+        self.stats[indices] = base
+        self.calc_max_hp(indices)
+        self.hp[indices] = self.max_hp[indices]
+        self.exp[indices] = 0
+        self.gold[indices] = 0
+        self.level[indices] = 1
+        self.effects[indices] = 0
+        self.floor[indices] = -1
+        self.score[indices] = 0.
+        self.working[indices] = True
+        self.steps[indices] = 0
+        for i in indices:
+            self.load_level(i)
+
+    def load_level(self, i):
+        ''' Generates next level of dungeon i, as Service.reload_game.'''
+        self.floor[i] += 1
+        self.position[i] = (1, 1)
+        _map, objects = Service.generate_level(self.floor[i], self.rng)
+        if isinstance(_map, Chunks.ChunkedMap):
+            raise ValueError("BatchEnvironment needs levels with array maps")
+
+        if _map.shape[0] > self.walls.shape[1] or _map.shape[1] > self.walls.shape[2]:
+            self.grow_map(_map.shape)
+        self.walls[i] = True
+        self.walls[i, :_map.shape[0], :_map.shape[1]] = ~Service.passable[_map]
+
+        if len(objects) > self.object_kind.shape[1]:
+            self.grow_objects(len(objects))
+        self.object_grid[i] = -1
+        self.object_kind[i] = NONE
+        for k, obj in enumerate(objects):
+            if isinstance(obj, Objects.Enemy):
+                self.object_kind[i, k] = ENEMY
+                self.object_stats[i, k] = [obj.stats[name] for name in STATS]
+                self.object_exp[i, k] = obj.exp
+            else:
+                self.object_kind[i, k] = ACTION_KINDS[obj.action.__name__]
+            self.object_grid[i, obj.position[1], obj.position[0]] = k
+
+    def grow_map(self, shape):
+        ''' Pads map arrays of all dungeons to hold maps of given shape.'''
+        extra_y = max(shape[0] - self.walls.shape[1], 0)
+        extra_x = max(shape[1] - self.walls.shape[2], 0)
+        pad = ((0, 0), (0, extra_y), (0, extra_x))
+        self.walls = np.pad(self.walls, pad, constant_values=True)
+        self.object_grid = np.pad(self.object_grid, pad, constant_values=-1)
+
+    def grow_objects(self, count):
+        extra = count - self.object_kind.shape[1]
+        self.object_kind = np.pad(self.object_kind, ((0, 0), (0, extra)))
+        self.object_stats = np.pad(self.object_stats, ((0, 0), (0, extra), (0, 0)))
+        self.object_exp = np.pad(self.object_exp, ((0, 0), (0, extra)))
+
+    # STEP
+    def step(self, actions):
+        idx = np.arange(self.n)
+        prev_score = self.score.copy()
+        self.steps += 1
+        self.score -= 0.02
+
+        # Wall check of GameEngine.move_*
+        target = self.position + MOVES[np.asarray(actions)]
+        free = ~self.walls[idx, target[:, 1], target[:, 0]]
+        self.position[free] = target[free]
+
+        # Pickup of GameEngine.interact
+        x, y = self.position[:, 0], self.position[:, 1]
+        hit = np.where(free, self.object_grid[idx, y, x], -1)
+        touched = hit >= 0
+        self.object_grid[idx[touched], y[touched], x[touched]] = -1
+        kind = np.where(touched, self.object_kind[idx, hit], NONE)
+
+        self.fight(idx[kind == ENEMY], hit[kind == ENEMY])
+        self.add_gold(idx[kind == CHEST])
+        self.apply_blessing(idx[kind == BLESS])
+        self.remove_effect(idx[kind == REMOVE])
+        self.restore_hp(idx[kind == HEAL])
+        for i in idx[kind == STAIRS]:
+            self.load_level(i)
+
+        rewards = self.score - prev_score
+        dones = self.done
+        info = {'level': self.floor.copy(), 'steps': self.steps.copy()}
+        if dones.any():
+            self.reset_envs(idx[dones])
+        return self.observe(), rewards, dones, info
+
+    @property
+    def done(self):
+        # Last level in list is the final screen without objects
+        done = ~self.working | (self.floor >= len(Service.level_list) - 1)
+        if self.max_steps is not None:
+            done |= self.steps >= self.max_steps
+        return done
+
+    def observe(self):
+        return {'position': self.position.copy(),
+                'hp': self.hp.copy(),
+                'max_hp': self.max_hp.copy(),
+                'exp': self.exp.copy(),
+                'gold': self.gold.copy(),
+                'level': self.level.copy(),
+                'floor': self.floor.copy()}
+
+    # HERO
+    def calc_max_hp(self, i):
+        self.max_hp[i] = 5 + self.stats[i, ENDURANCE].astype(np.int64) * 2
+
+    def apply_stats(self, i, delta):
+        ''' Effect of Objects.Effect subclasses, stats change for good.'''
+        self.stats[i] += delta
+        self.effects[i] += 1
+        self.calc_max_hp(i)
+        self.hp[i] = self.max_hp[i]
+
+    def fight(self, i, k):
+        ''' Vectorized Enemy.interact.'''
+        enemy = self.object_stats[i, k]
+        hero = self.stats[i]
+        crit_factor = 1 + self.rng.random(len(i)) * enemy[:, LUCK] ** 0.5
+        intl_factor = np.log(1 + enemy[:, INTELLIGENCE] /
+                             np.maximum(1, hero[:, INTELLIGENCE]))
+        base_factor = enemy[:, STRENGTH] * enemy[:, ENDURANCE]
+        armr_factor = hero[:, STRENGTH] * hero[:, ENDURANCE]
+        damage = np.maximum(1, crit_factor * intl_factor * base_factor /
+                            np.maximum(1, armr_factor))
+
+        enemy_exp = self.object_exp[i, k]
+        self.exp[i] += enemy_exp // 2
+        self.hp[i] -= damage.astype(np.int64)
+        self.working[i[self.hp[i] <= 0]] = False
+
+        # Hero.level_up raises one level per fight
+        up = i[self.exp[i] >= 100 * 2 ** (self.level[i] - 1)]
+        self.level[up] += 1
+        self.stats[up, STRENGTH] += 2
+        self.stats[up, ENDURANCE] += 2
+        self.calc_max_hp(up)
+        self.hp[up] = self.max_hp[up]
+
+        self.score[i] += np.round(10 * self.level[i] * enemy_exp /
+                                  np.maximum(1, self.exp[i]), 2)
+
+    def add_gold(self, i):
+        cursed = self.rng.integers(1, 11, len(i)) == 1
+        self.score[i[cursed]] -= 0.05
+        self.apply_stats(i[cursed], [-1, -1, -1, -1])
+
+        lucky = i[~cursed]
+        self.score[lucky] += 0.1
+        gold = self.rng.integers(10, 1001, len(lucky)) * 1.1 ** (self.level[lucky] - 1)
+        self.gold[lucky] += gold.astype(np.int64)
+
+    def apply_blessing(self, i):
+        cost = (20 * 1.5 ** self.floor[i]).astype(np.int64) - \
+            2 * self.stats[i, INTELLIGENCE].astype(np.int64)
+        paid = self.gold[i] >= cost
+        self.score[i[~paid]] -= 0.1
+        self.score[i[paid]] += 0.2
+        self.gold[i[paid]] -= cost[paid]
+
+        i = i[paid]
+        blessing = self.rng.integers(0, 2, len(i)) == 0
+        self.apply_stats(i[blessing], [1, 1, 1, 1])
+        self.apply_stats(i[~blessing], [3, 3, -3, 3])
+
+    def remove_effect(self, i):
+        cost = (10 * 1.5 ** self.floor[i]).astype(np.int64) - \
+            2 * self.stats[i, INTELLIGENCE].astype(np.int64)
+        paid = (self.gold[i] >= cost) & (self.effects[i] > 0)
+        self.gold[i[paid]] -= cost[paid]
+        self.effects[i[paid]] -= 1
+        self.calc_max_hp(i[paid])
+
+    def restore_hp(self, i):
+        self.score[i] += 0.1
+        self.hp[i] = self.max_hp[i]
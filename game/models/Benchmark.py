@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+
+# Benchmarks run without a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+
+from models import Assets, Environment, ScreenEngine as SE, Service
+
+SCREEN_DIM = (800, 600)
+SPRITE_SIZES = (20, 40, 60, 80)
+
+benchmarks = []
+
+
+def benchmark(number):
+    ''' Registers a generator of (name, function) cases, function is
+    called `number` times per measurement.'''
+    def register(cases):
+        benchmarks.append((cases, number))
+        return cases
+    return register
+
+
+def create_env(sprite_size=60):
+    env = Environment.GameEnvironment()
+    env.reset(0)
+    env.engine.sprite_size = sprite_size
+    Service.load_textures(sprite_size)
+    env.hero.sprite = Service.create_sprite(
+        os.path.join("texture", "Hero_right.png"), sprite_size)
+    return env
+
+
+def create_drawer(engine):
+    drawer = SE.GameSurface((640, 480), pygame.SRCALPHA, (0, 480),
+                            SE.ProgressBar((640, 120), (640, 0),
+                                           SE.InfoWindow((160, 600), (50, 50),
+                                                         SE.HelpWindow((700, 500), pygame.SRCALPHA, (0, 0),
+                                                                       SE.ScreenHandle((0, 0))))))
+    drawer.connect_engine(engine)
+    return drawer
+
+
+def random_walk(env):
+    ''' Step function making seeded random moves, restarting finished games.'''
+    moves = np.random.default_rng(0).integers(0, len(Environment.ACTIONS), 4096)
+    state = {'i': 0}
+
+    def step():
+        if env.done:
+            env.reset(state['i'])
+        env.step(moves[state['i'] % len(moves)])
+        state['i'] += 1
+    return step
+
+
+# GENERATION
+@benchmark(number=20)
+def map_cases():
+    Service.service_init(None)
+    rng = np.random.default_rng(0)
+    for factory in Service.MapFactory.__subclasses__():
+        level = factory()
+        if hasattr(level, 'Map'):
+            yield f'map/{factory.__name__}', lambda level=level: level.Map(rng, level.shape)
+
+    # Chunk of a big map, tiles and objects
+    level = Service.OpenMap({'size': [4096, 4096], 'per-chunk': {'rat': 4, 'chest': 1}})
+    chunks = iter(range(10**9))
+
+    def open_chunk():
+        cx, cy = divmod(next(chunks), 64)
+        level.chunk_objects(0, cx, cy, level.chunk_tiles(0, cx, cy))
+    yield 'map/OpenMap_chunk', open_chunk
+
+
+@benchmark(number=20)
+def placement_cases():
+    Service.service_init(None)
+    rng = np.random.default_rng(0)
+    for i, level in enumerate(Service.level_list):
+        if not hasattr(level, 'Map'):
+            continue
+        _map = level.Map(rng, level.shape).get_map()
+        yield f'placement/level_{i}', lambda level=level, _map=_map: level.create_objects(_map, rng)
+
+
+@benchmark(number=20)
+def config_cases():
+    # YAML parsing and checks against reading the compiled cache
+    yield 'config/compile', Service.compile_config
+    yield 'config/load', Service.load_config
+
+
+@benchmark(number=3)
+def service_init_cases():
+    for size in SPRITE_SIZES:
+        def init(size=size):
+            Assets.manager.clear()
+            Service.service_init(size)
+        yield f'service_init/size_{size}', init
+
+
+# LOGIC
+@benchmark(number=1000)
+def engine_cases():
+    # Moves with wall checks, pickups, fights and level changes
+    yield 'engine/step', random_walk(create_env())
+
+
+# RENDERING
+@benchmark(number=50)
+def render_cases():
+    for size in SPRITE_SIZES:
+        env = create_env(size)
+        surface = SE.GameSurface((640, 480), pygame.SRCALPHA, (0, 0), SE.ScreenHandle((0, 0)))
+        surface.connect_engine(env.engine)
+
+        def render(surface=surface):
+            surface.invalidate()
+            surface.render()
+        yield f'render/game_surface_{size}', render
+
+    # Zoom step, terrain chunks are drawn again at the new size
+    zoom = {'size': 40}
+
+    def render_zoom():
+        zoom['size'] = 82 - zoom['size']
+        surface.game_engine.sprite_size = zoom['size']
+        Service.load_textures(zoom['size'])
+        surface.render()
+    yield 'render/game_surface_zoom', render_zoom
+
+    display = pygame.display.get_surface()
+    env = create_env()
+    drawer = create_drawer(env.engine)
+
+    def compose():
+        drawer.invalidate()
+        drawer.compose(display)
+    yield 'render/chain', compose
+
+    step = random_walk(env)
+
+    def step_compose():
+        step()
+        drawer.compose(display)
+    yield 'render/chain_step', step_compose
+
+
+def measure(function, number, repeat):
+    ''' Seconds per call: best and median of `repeat` runs.'''
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {'min': min(times), 'median': statistics.median(times),
+            'number': number, 'repeat': repeat}
+
+
+def run(pattern=None, repeat=5):
+    pygame.init()
+    pygame.display.set_mode(SCREEN_DIM)
+    results = {}
+    for cases, number in benchmarks:
+        for name, function in cases():
+            if pattern and pattern not in name:
+                continue
+            results[name] = measure(function, number, repeat)
+            print(f"{name:32} {results[name]['median'] * 1e3:10.4f} ms", flush=True)
+    pygame.quit()
+    return {'machine': {'python': platform.python_version(),
+                        'pygame': pygame.version.ver,
+                        'numpy': np.__version__,
+                        'platform': platform.platform()},
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results}
+
+
+def compare(base, new, threshold=0.1):
+    ''' Prints median times of two runs, returns names of regressions.'''
+    regressions = []
+    for name in sorted(set(base['results']) | set(new['results'])):
+        old = base['results'].get(name)
+        cur = new['results'].get(name)
+        if old is None or cur is None:
+            print(f"{name:32} {'only in ' + ('new' if old is None else 'base'):>32}")
+            continue
+        ratio = cur['median'] / old['median']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print(f"{name:32} {old['median'] * 1e3:10.4f} ms {cur['median'] * 1e3:10.4f} ms "
+              f"{ratio:6.2f}x {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks, run from game directory")
+    parser.add_argument("--output", help="save results to JSON file")
+    parser.add_argument("--filter", help="run only benchmarks with names containing it")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"),
+                        help="compare two saved runs instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown of median reported as regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as base, open(args.compare[1]) as new:
+            regressions = compare(json.load(base), json.load(new), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        return
+
+    results = run(args.filter, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
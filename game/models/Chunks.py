@@ -0,0 +1,147 @@
+import collections
+import numpy as np
+
+
+class ChunkedMap:
+    """ Map of tile ids stored as square chunks made on demand.
+
+    generate_tiles(cx, cy) returns uint8 (chunk_size, chunk_size) tiles of
+    chunk (cx, cy), cells outside of the map have to be walls. It has to
+    give the same tiles every time, because only the last used
+    `max_chunks` chunks are kept. generate_objects(cx, cy, tiles) returns
+    objects of the chunk, it is called once per chunk by ObjectIndex.
+
+    Indexing with [y, x] and [y0:y1, x0:x1] works as for arrays of tiles.
+    """
+
+    def __init__(self, shape, chunk_size, generate_tiles, generate_objects,
+                 max_chunks=64):
+        self.shape = tuple(shape)
+        self.chunk_size = chunk_size
+        self.generate_tiles = generate_tiles
+        self.generate_objects = generate_objects
+        self.max_chunks = max_chunks
+        self.chunks = collections.OrderedDict()
+
+    def chunk_key(self, x, y):
+        return x // self.chunk_size, y // self.chunk_size
+
+    def chunk(self, cx, cy):
+        ''' Tiles of chunk (cx, cy), least recently used chunks are evicted.'''
+        key = (cx, cy)
+        tiles = self.chunks.get(key)
+        if tiles is None:
+            tiles = self.generate_tiles(cx, cy)
+            tiles.flags.writeable = False
+            self.chunks[key] = tiles
+            if len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(key)
+        return tiles
+
+    def __getitem__(self, index):
+        y, x = index
+        if isinstance(y, slice) or isinstance(x, slice):
+            return self.window(y, x)
+        height, width = self.shape
+        if not (-height <= y < height and -width <= x < width):
+            raise IndexError(f"index {index} is out of map of shape {self.shape}")
+        y, x = y % height, x % width
+        size = self.chunk_size
+        return self.chunk(x // size, y // size)[y % size, x % size]
+
+    def window(self, rows, columns):
+        ''' Array of tiles of a slice of the map.'''
+        if not isinstance(rows, slice):
+            rows = slice(rows, rows + 1)
+        if not isinstance(columns, slice):
+            columns = slice(columns, columns + 1)
+        y0, y1, _ = rows.indices(self.shape[0])
+        x0, x1, _ = columns.indices(self.shape[1])
+        size = self.chunk_size
+        result = np.empty((max(y1 - y0, 0), max(x1 - x0, 0)), dtype=np.uint8)
+        for cy in range(y0 // size, -(-y1 // size)):
+            for cx in range(x0 // size, -(-x1 // size)):
+                top, bottom = max(y0, cy * size), min(y1, (cy + 1) * size)
+                left, right = max(x0, cx * size), min(x1, (cx + 1) * size)
+                result[top - y0:bottom - y0, left - x0:right - x0] = \
+                    self.chunk(cx, cy)[top - cy * size:bottom - cy * size,
+                                       left - cx * size:right - cx * size]
+        return result
+
+    def view(self, table):
+        ''' Map of table[tile] values, as table[array] for arrays of tiles.'''
+        return TableView(self, table)
+
+    def object_index(self):
+        return ObjectIndex(self)
+
+
+class TableView:
+    ''' Lookup table applied to tiles of a ChunkedMap on indexing.'''
+
+    def __init__(self, chunked, table):
+        self.map = chunked
+        self.table = table
+
+    @property
+    def shape(self):
+        return self.map.shape
+
+    def __getitem__(self, index):
+        return self.table[self.map[index]]
+
+
+class ObjectIndex:
+    """ Objects of a ChunkedMap by (x, y) position, kept per chunk.
+
+    Objects of a chunk are generated at the first lookup in it and are
+    kept after its tiles are evicted, so taken objects don't come back.
+    Only explored chunks take memory.
+    """
+
+    def __init__(self, chunked, buckets=None):
+        self.map = chunked
+        self.buckets = {} if buckets is None else buckets
+
+    def bucket(self, x, y):
+        key = self.map.chunk_key(x, y)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            objects = self.map.generate_objects(key[0], key[1], self.map.chunk(*key))
+            bucket = {tuple(obj.position): obj for obj in objects}
+            self.buckets[key] = bucket
+        return bucket
+
+    def get(self, position, default=None):
+        return self.bucket(*position).get(tuple(position), default)
+
+    def __setitem__(self, position, obj):
+        self.bucket(*position)[tuple(position)] = obj
+
+    def __delitem__(self, position):
+        del self.bucket(*position)[tuple(position)]
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def values(self):
+        ''' Objects of explored chunks.'''
+        return [obj for bucket in self.buckets.values() for obj in bucket.values()]
+
+    def values_in(self, x0, y0, x1, y1):
+        ''' Objects of chunks overlapping area x0 <= x < x1, y0 <= y < y1.'''
+        height, width = self.map.shape
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, width), min(y1, height)
+        size = self.map.chunk_size
+        objects = []
+        for cy in range(y0 // size, -(-y1 // size)):
+            for cx in range(x0 // size, -(-x1 // size)):
+                objects.extend(self.bucket(cx * size, cy * size).values())
+        return objects
+
+    def copy(self):
+        return ObjectIndex(self.map, {key: dict(bucket)
+                                      for key, bucket in self.buckets.items()})
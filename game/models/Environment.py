@@ -0,0 +1,119 @@
+import os
+import numpy as np
+
+from models import Logic, Objects, Observation, Service
+
+# Same order as the automated mode of Main.py
+ACTIONS = ('move_right', 'move_left', 'move_up', 'move_down')
+
+BASE_STATS = {
+    "strength": 20,
+    "endurance": 20,
+    "intelligence": 5,
+    "luck": 5
+}
+
+
+class GameEnvironment:
+    """ Headless game simulation with reset()/step() interface.
+
+    Observations are symbolic by default, see Observation.observe, and
+    nothing then needs pygame or a display. With observation='pixels'
+    the game area is rendered by Observation.PixelObserver (use the SDL
+    dummy video driver to run it without a window). To watch an episode
+    connect a ScreenEngine chain to `engine` and load textures with
+    Service.load_textures.
+    With pool_depth levels are generated ahead by Service.LevelPool, the
+    first level of the next game too when reset() picks seeds itself.
+    The pool is one per process and shared by all environments in it, it
+    keeps the greatest pool_depth asked for.
+    """
+
+    def __init__(self, base_stats=None, max_steps=None, radius=7,
+                 observation='symbolic', sprite_size=60, screen_size=(640, 480),
+                 pixel_size=None, frame_stack=1, pool_depth=0):
+        self.base_stats = base_stats if base_stats is not None else BASE_STATS
+        self.max_steps = max_steps
+        self.radius = radius
+        self.observation = observation
+        self.sprite_size = sprite_size
+        self.screen_size = screen_size
+        self.pixel_size = pixel_size
+        self.frame_stack = frame_stack
+        self.pixels = None
+        self.engine = None
+        self.hero = None
+        self.steps = 0
+        self.next_seed = None
+        if not hasattr(Service, 'level_list'):
+            Service.service_init(None)
+        if pool_depth and Service.level_pool is None:
+            Service.level_pool = Service.LevelPool(pool_depth)
+        elif pool_depth:
+            Service.level_pool.depth = max(Service.level_pool.depth, pool_depth)
+
+    def reset(self, seed=None):
+        picked = seed is None
+        if picked:
+            seed = self.next_seed
+            if seed is None:
+                seed = np.random.SeedSequence().entropy
+            self.next_seed = np.random.SeedSequence().entropy
+        self.hero = Objects.Hero(dict(self.base_stats), None)
+        self.engine = Logic.GameEngine(seed)
+        Service.reload_game(self.engine, self.hero)
+        self.steps = 0
+        if picked:
+            self.prefetch(self.next_seed)
+        if self.observation == 'pixels':
+            self.connect_pixels()
+            return {'pixels': self.pixels.reset()}
+        return self.observe()
+
+    def step(self, action):
+        engine = self.engine
+        prev_score = engine.score
+        getattr(engine, ACTIONS[action])()
+        self.steps += 1
+        reward = engine.score - prev_score
+        return self.observe(), reward, self.done, {'level': engine.level,
+                                                   'steps': self.steps}
+
+    @property
+    def done(self):
+        engine = self.engine
+        if not engine.working or not engine.game_process:
+            return True
+        # Last level in list is the final screen without objects
+        if engine.level >= len(Service.level_list) - 1:
+            return True
+        return self.max_steps is not None and self.steps >= self.max_steps
+
+    def prefetch(self, seed):
+        ''' Starts generating first level of a game with seed, if levels
+        are pooled.'''
+        if Service.level_pool is not None:
+            Service.level_pool.prefetch(seed, 0)
+
+    def connect_pixels(self):
+        import pygame
+        from models import ScreenEngine
+
+        if self.pixels is None:
+            if pygame.display.get_surface() is None:
+                pygame.display.init()
+                pygame.display.set_mode((1, 1))
+            surface = ScreenEngine.GameSurface(self.screen_size, pygame.SRCALPHA, (0, 0),
+                                               ScreenEngine.ScreenHandle((0, 0)))
+            self.pixels = Observation.PixelObserver(surface, self.pixel_size,
+                                                    self.frame_stack)
+        self.engine.sprite_size = self.sprite_size
+        Service.load_textures(self.sprite_size)
+        self.hero.sprite = Service.create_sprite(
+            os.path.join("texture", "Hero_right.png"), self.sprite_size)
+        self.pixels.surface.connect_engine(self.engine)
+
+    def observe(self):
+        if self.observation == 'pixels':
+            return {'pixels': self.pixels.observe()}
+        return self.engine.observe(self.radius)
@@ -1,16 +1,33 @@
-from models import Service
+import numpy as np
+
+from models import Chunks, Observation, Service
 
 
 class GameEngine:
-    objects = []
-    map = None
-    hero = None
-    level = -1
-    working = True
-    subscribers = set()
-    score = 0.
-    game_process = True
-    show_help = False
+    """ State and rules of one game.
+
+    Randomness of actions and combat is drawn from `rng`, levels are
+    generated with level_rng, both derived from `seed`. The same seed and
+    actions give the same game, engines don't share random state.
+    State can be saved with snapshot() and brought back with restore().
+    """
+
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        # Objects by their (x, y) position
+        self.object_index = {}
+        self.map = None
+        self.passable = None
+        self.hero = None
+        self.level = -1
+        self.working = True
+        self.subscribers = set()
+        self.score = 0.
+        self.game_process = True
+        self.show_help = False
 
     def subscribe(self, obj):
         self.subscribers.add(obj)
@@ -23,55 +40,125 @@ class GameEngine:
         for i in self.subscribers:
             i.update(message)
 
+    def level_rng(self, level):
+        ''' Generator of level, independent of actions made before it.'''
+        return Service.level_rng(self.seed, level)
+
+    def observe(self, radius=7):
+        ''' Symbolic observation of the game, see Observation.observe.'''
+        return Observation.observe(self, radius)
+
     # HERO
     def add_hero(self, hero):
         self.hero = hero
 
     def interact(self):
-        for obj in self.objects:
-            if list(obj.position) == self.hero.position:
-                self.delete_object(obj)
-                obj.interact(self, self.hero)
+        obj = self.object_index.get(tuple(self.hero.position))
+        if obj is not None:
+            self.delete_object(obj)
+            obj.interact(self, self.hero)
 
     # MOVEMENT
     def move_up(self):
         self.score -= 0.02
-        if self.map[self.hero.position[1] - 1][self.hero.position[0]] == Service.wall:
+        if not self.passable[self.hero.position[1] - 1, self.hero.position[0]]:
             return
         self.hero.position[1] -= 1
         self.interact()
 
     def move_down(self):
         self.score -= 0.02
-        if self.map[self.hero.position[1] + 1][self.hero.position[0]] == Service.wall:
+        if not self.passable[self.hero.position[1] + 1, self.hero.position[0]]:
             return
         self.hero.position[1] += 1
         self.interact()
 
     def move_left(self):
         self.score -= 0.02
-        if self.map[self.hero.position[1]][self.hero.position[0] - 1] == Service.wall:
+        if not self.passable[self.hero.position[1], self.hero.position[0] - 1]:
             return
         self.hero.position[0] -= 1
         self.interact()
 
     def move_right(self):
         self.score -= 0.02
-        if self.map[self.hero.position[1]][self.hero.position[0] + 1] == Service.wall:
+        if not self.passable[self.hero.position[1], self.hero.position[0] + 1]:
             return
         self.hero.position[0] += 1
         self.interact()
 
+    # STATE
+    def snapshot(self):
+        ''' Cheap copy of game state for restore().
+
+        Maps are read-only and shared, objects are never changed, so only
+        the index of them is copied; hero is copied with its effects.'''
+        return {'map': self.map,
+                'passable': self.passable,
+                'objects': self.object_index.copy(),
+                'hero': self.hero.clone(),
+                'level': self.level,
+                'score': self.score,
+                'working': self.working,
+                'game_process': self.game_process,
+                'show_help': self.show_help,
+                'rng': self.rng.bit_generator.state}
+
+    def restore(self, snapshot):
+        ''' Brings back state of snapshot, it can be restored again.
+        Subscribers are kept, references to the old hero are not updated.'''
+        self.map = snapshot['map']
+        self.passable = snapshot['passable']
+        self.object_index = snapshot['objects'].copy()
+        self.hero = snapshot['hero'].clone()
+        self.level = snapshot['level']
+        self.score = snapshot['score']
+        self.working = snapshot['working']
+        self.game_process = snapshot['game_process']
+        self.show_help = snapshot['show_help']
+        self.rng.bit_generator.state = snapshot['rng']
+
     # MAP
     def load_map(self, game_map):
+        ''' Sets map, an array of tiles or a Chunks.ChunkedMap, before
+        objects of it are added.'''
         self.map = game_map
+        if isinstance(game_map, Chunks.ChunkedMap):
+            self.passable = game_map.view(Service.passable)
+            return
+        # Maps are shared by snapshots
+        game_map.flags.writeable = False
+        self.passable = Service.passable[game_map]
+        self.passable.flags.writeable = False
 
     # OBJECTS
+    @property
+    def objects(self):
+        return self.object_index.values()
+
+    @objects.setter
+    def objects(self, objects):
+        if isinstance(self.map, Chunks.ChunkedMap):
+            self.object_index = self.map.object_index()
+        else:
+            self.object_index = {}
+        self.add_objects(objects)
+
+    def objects_in(self, x0, y0, x1, y1):
+        ''' Objects in area x0 <= x < x1, y0 <= y < y1.'''
+        if isinstance(self.object_index, Chunks.ObjectIndex):
+            objects = self.object_index.values_in(x0, y0, x1, y1)
+        else:
+            objects = self.object_index.values()
+        return [obj for obj in objects
+                if x0 <= obj.position[0] < x1 and y0 <= obj.position[1] < y1]
+
     def add_object(self, obj):
-        self.objects.append(obj)
+        self.object_index[tuple(obj.position)] = obj
 
     def add_objects(self, objects):
-        self.objects.extend(objects)
+        for obj in objects:
+            self.add_object(obj)
 
     def delete_object(self, obj):
-        self.objects.remove(obj)
+        del self.object_index[tuple(obj.position)]
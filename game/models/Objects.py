@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
-import pygame
-import random
-import numpy as np
+import copy
+import math
+
+from models import Assets
 
 
 def calculate_left_corner(hero, display):
@@ -15,32 +16,24 @@ def calculate_left_corner(hero, display):
 
     shape_x = width // sprite_size
     shape_y = length // sprite_size
-    map_size = 41
-    if shape_x//2 <= x <= map_size - shape_x//2:
+    map_height, map_width = display.game_engine.map.shape
+    if shape_x//2 <= x <= map_width - shape_x//2:
         min_x = x - shape_x//2
     elif x < shape_x//2:
         min_x = 0
-    elif x > map_size - shape_x//2:
-        min_x = map_size - shape_x
+    elif x > map_width - shape_x//2:
+        min_x = map_width - shape_x
 
-    if shape_y//2 <= y <= map_size - shape_y//2:
+    if shape_y//2 <= y <= map_height - shape_y//2:
         min_y = y - shape_y//2
     elif y < shape_y//2:
         min_y = 0
-    elif y > map_size - shape_y//2:
-        min_y = map_size - shape_y
+    elif y > map_height - shape_y//2:
+        min_y = map_height - shape_y
 
     return (min_x, min_y)
 
 
-def create_sprite(img, sprite_size):
-    icon = pygame.image.load(img).convert_alpha()
-    icon = pygame.transform.scale(icon, (sprite_size, sprite_size))
-    sprite = pygame.Surface((sprite_size, sprite_size), pygame.HWSURFACE)
-    sprite.blit(icon, (0, 0))
-    return sprite
-
-
 class AbstractObject(ABC):
 
     @abstractmethod
@@ -52,15 +45,11 @@ class AbstractObject(ABC):
         size = display.game_engine.sprite_size
         sprite = self.sprite
         coord = self.position
-        display.blit(sprite, ((coord[0] - min_x)* size, (coord[1] - min_y) * size))
+        return display.blit(sprite, ((coord[0] - min_x)* size, (coord[1] - min_y) * size))
 
 
 def create_sprite(img, sprite_size):
-    icon = pygame.image.load(img).convert_alpha()
-    icon = pygame.transform.scale(icon, (sprite_size, sprite_size))
-    sprite = pygame.Surface((sprite_size, sprite_size), pygame.HWSURFACE)
-    sprite.blit(icon, (0, 0))
-    return sprite
+    return Assets.manager.get_sprite(img, sprite_size)
 
 
 class Interactive(ABC):
@@ -72,10 +61,11 @@ class Interactive(ABC):
 
 class Ally(AbstractObject, Interactive):
 
-    def __init__(self, icon, action, position):
+    def __init__(self, icon, action, position, name=None):
         self.sprite = icon
         self.action = action
         self.position = position
+        self.name = name
 
     def interact(self, engine, hero):
         self.action(engine, hero)
@@ -112,13 +102,21 @@ class Hero(Creature):
             self.hp = self.max_hp
             return "level up!"
 
+    def clone(self, stats=None):
+        ''' Copy of hero with a copy of stats or with given stats dict.'''
+        hero = copy.copy(self)
+        hero.stats = dict(self.stats) if stats is None else stats
+        hero.position = list(self.position)
+        return hero
+
 
 class Enemy(Creature, Interactive):
 
-    def __init__(self, icon, stats, xp, position):
+    def __init__(self, icon, stats, xp, position, name=None):
         # Init from Creature
         super().__init__(icon, stats, position)
         self.exp = xp
+        self.name = name
 
     def interact(self, engine, hero):
         def damage(self, hero):
@@ -126,8 +124,8 @@ class Enemy(Creature, Interactive):
             hero_stats = hero.stats
             enemy_stats = self.stats
             # Calculation factor of hit
-            crit_factor = (1 + random.random() * enemy_stats['luck'] ** 0.5)
-            intl_factor = np.log(1 + enemy_stats['intelligence'] / max(1, hero_stats['intelligence']))
+            crit_factor = (1 + engine.rng.random() * enemy_stats['luck'] ** 0.5)
+            intl_factor = math.log(1 + enemy_stats['intelligence'] / max(1, hero_stats['intelligence']))
             base_factor = enemy_stats['strength'] * enemy_stats['endurance']
             armr_factor = hero_stats['strength'] * hero_stats['endurance']
             damage = crit_factor * intl_factor * base_factor / max(1,armr_factor)
@@ -213,6 +211,15 @@ class Effect(Hero):
     def sprite(self):
         return self.base.sprite
 
+    def clone(self, stats=None):
+        ''' Copy of the whole chain of effects, layers sharing stats
+        dict in the chain share it in the copy too.'''
+        effect = copy.copy(self)
+        effect.stats = dict(self.stats) if stats is None else stats
+        shared = self.base.stats is self.stats
+        effect.base = self.base.clone(effect.stats if shared else None)
+        return effect
+
     @abstractmethod
     def apply_effect(self):
         pass
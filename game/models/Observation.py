@@ -0,0 +1,112 @@
+import numpy as np
+
+from models import Service
+
+# Values of the hero stats vector
+STATS = ('hp', 'max_hp', 'exp', 'level', 'gold', 'strength', 'endurance',
+         'intelligence', 'luck', 'floor', 'x', 'y')
+
+# Channel of every name of channels(), made for the config loaded then
+index_config = None
+channel_index = {}
+
+
+def channels():
+    ''' Names of grid channels: walls, then every enemy, ally and object.'''
+    config = Service.object_list_prob
+    return ['wall'] + list(config['enemies']) + list(config['ally']) + \
+        list(config['objects'])
+
+
+def channel_indices():
+    ''' {name: channel} of the loaded config, made again only after
+    service_init loads it again.'''
+    global index_config, channel_index
+    config = Service.object_list_prob
+    if config is not index_config:
+        channel_index = {name: i for i, name in enumerate(channels())}
+        index_config = config
+    return channel_index
+
+
+def observe(engine, radius=7):
+    ''' Symbolic observation of the map window around the hero.
+
+    grid is int8 array (channels, 2 * radius + 1, 2 * radius + 1) with
+    cells outside of the map marked as walls, stats is float32 vector
+    of STATS. Nothing is rendered.
+    '''
+    index = channel_indices()
+    side = 2 * radius + 1
+    grid = np.zeros((len(index), side, side), dtype=np.int8)
+
+    hero = engine.hero
+    x0, y0 = hero.position[0] - radius, hero.position[1] - radius
+    height, width = engine.passable.shape
+    top, bottom = max(y0, 0), min(y0 + side, height)
+    left, right = max(x0, 0), min(x0 + side, width)
+    grid[0] = 1
+    if top < bottom and left < right:
+        grid[0, top - y0:bottom - y0, left - x0:right - x0] = \
+            ~engine.passable[top:bottom, left:right]
+
+    for obj in engine.objects_in(x0, y0, x0 + side, y0 + side):
+        grid[index[obj.name], obj.position[1] - y0, obj.position[0] - x0] = 1
+
+    stats = np.array([hero.hp, hero.max_hp, hero.exp, hero.level, hero.gold,
+                      hero.stats["strength"], hero.stats["endurance"],
+                      hero.stats["intelligence"], hero.stats["luck"],
+                      engine.level, hero.position[0], hero.position[1]],
+                     dtype=np.float32)
+    return {'grid': grid, 'stats': stats}
+
+
+class PixelObserver:
+    """ Renders the game area of a GameSurface into a reused pixel buffer.
+
+    Frames are optionally downscaled to size (width, height) and kept in
+    a ring of the last `stack` frames. The returned frames are a view of
+    the preallocated buffer, oldest first, valid until the next call;
+    copy them to keep them.
+    """
+
+    def __init__(self, surface, size=None, stack=1):
+        import pygame
+
+        self.surface = surface
+        self.size = tuple(size) if size else surface.get_size()
+        self.scaled = None
+        if self.size != surface.get_size():
+            self.scaled = pygame.Surface(self.size, surface.get_flags(), surface)
+        self.stack = stack
+        width, height = self.size
+        # Every frame is written twice, so the last `stack` frames are
+        # always a contiguous slice of the buffer
+        self.buffer = np.zeros((2 * stack, height, width, 3), dtype=np.uint8)
+        self.index = 0
+
+    def view(self):
+        ''' Renders a frame, returns pixels3d view (width, height, 3) of it.
+
+        The view locks the surface, delete it before the next render.'''
+        import pygame
+
+        self.surface.render()
+        frame = self.surface
+        if self.scaled is not None:
+            frame = pygame.transform.smoothscale(self.surface, self.size, self.scaled)
+        return pygame.surfarray.pixels3d(frame)
+
+    def observe(self):
+        pixels = self.view().transpose(1, 0, 2)
+        np.copyto(self.buffer[self.index], pixels)
+        np.copyto(self.buffer[self.index + self.stack], pixels)
+        del pixels
+        self.index = (self.index + 1) % self.stack
+        return self.buffer[self.index:self.index + self.stack]
+
+    def reset(self):
+        ''' Fills the whole stack with the current frame.'''
+        frames = self.observe()
+        self.buffer[:] = frames[-1]
+        return self.buffer[self.index:self.index + self.stack]
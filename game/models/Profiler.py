@@ -0,0 +1,190 @@
+import collections
+import json
+import time
+import numpy as np
+import pygame
+
+from models import ScreenEngine
+
+PERCENTILES = (50, 90, 99)
+
+
+class CountedSurface(pygame.Surface):
+    ''' Surface whose blits can be counted, plain Surface has no __dict__.'''
+
+
+class FrameProfiler:
+    """ Per frame timings of the drawing chain and of the main loop.
+
+    attach(drawer) wraps render of every link of the chain to record its
+    time, blits on the link and font renders made by it. Main loop stages
+    are timed with start()/stop(), end_frame() closes the frame. The last
+    `window` frames are kept for percentiles; frames slower than
+    `spike_time` seconds are kept whole in `spikes`.
+    """
+
+    def __init__(self, window=300, spike_time=1 / 30):
+        self.samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=window))
+        self.spikes = collections.deque(maxlen=100)
+        self.spike_time = spike_time
+        self.frames = 0
+        self.frame = collections.Counter()
+        self.started = {}
+        self.link = None
+        self.overlay = False
+        self.overlay_surface = None
+        self.hook_fonts()
+
+    # INSTRUMENTATION
+    def hook_fonts(self):
+        render_text = ScreenEngine.render_text
+        if getattr(render_text, 'profiler', None) is self:
+            return
+
+        def counted(*args, **kwargs):
+            self.frame[f'fonts/{self.link or "other"}'] += 1
+            return render_text(*args, **kwargs)
+        counted.profiler = self
+        ScreenEngine.render_text = counted
+
+    def count_blits(self, surface, name):
+        blit, blits = surface.blit, surface.blits
+
+        def counted_blit(*args, **kwargs):
+            self.frame[f'blits/{name}'] += 1
+            return blit(*args, **kwargs)
+
+        def counted_blits(sequence, *args, **kwargs):
+            sequence = list(sequence)
+            self.frame[f'blits/{name}'] += len(sequence)
+            return blits(sequence, *args, **kwargs)
+        surface.blit = counted_blit
+        surface.blits = counted_blits
+
+    def attach(self, drawer):
+        ''' Instruments every link of the chain starting with drawer.'''
+        link = drawer
+        while link is not None:
+            name = type(link).__name__
+            self.count_blits(link, name)
+            terrain = getattr(link, 'terrain', None)
+            if isinstance(terrain, pygame.Surface):
+                link.terrain = CountedSurface(terrain.get_size(), terrain.get_flags(), terrain)
+                link.terrain.blit(terrain, (0, 0))
+                self.count_blits(link.terrain, name)
+            link.render = self.timed(link.render, name)
+            link = link.successor
+
+    def timed(self, render, name):
+        def timed_render():
+            outer, self.link = self.link, name
+            start = time.perf_counter()
+            try:
+                return render()
+            finally:
+                self.frame[f'render/{name}'] += time.perf_counter() - start
+                self.link = outer
+        return timed_render
+
+    # MAIN LOOP
+    def start(self, stage):
+        self.started[stage] = time.perf_counter()
+
+    def stop(self, stage):
+        self.frame[stage] += time.perf_counter() - self.started.pop(stage)
+
+    def end_frame(self):
+        frame = self.frame
+        frame['frame'] = sum(value for key, value in frame.items()
+                             if '/' not in key and key != 'frame')
+        # Counters missing in this frame were zero
+        for key in set(frame) | set(self.samples):
+            self.samples[key].append(frame[key])
+        if frame['frame'] > self.spike_time:
+            self.spikes.append(dict(frame, number=self.frames))
+        self.frames += 1
+        self.frame = collections.Counter()
+        # Overlay text is rendered again twice a second at 60 fps
+        if self.frames % 30 == 0:
+            self.overlay_surface = None
+
+    # REPORT
+    def percentiles(self):
+        ''' {key: {'p50': ..., 'p90': ..., 'p99': ..., 'max': ...}} of the
+        last frames, times are in milliseconds.'''
+        report = {}
+        for key, values in sorted(self.samples.items()):
+            values = np.array(values)
+            if '/' not in key or key.startswith('render/'):
+                values = values * 1e3
+            report[key] = {f'p{q}': float(np.percentile(values, q)) for q in PERCENTILES}
+            report[key]['max'] = float(values.max())
+        return report
+
+    def dump(self, path):
+        with open(path, 'w') as output:
+            json.dump({'frames': self.frames,
+                       'percentiles': self.percentiles(),
+                       'spikes': list(self.spikes)}, output, indent=2)
+
+    def draw_overlay(self, canvas):
+        ''' Draws percentiles over canvas if overlay is on, returns dirty rects.'''
+        if not self.overlay or not self.samples:
+            return []
+        if self.overlay_surface is None:
+            font = ScreenEngine.get_font("courier", 12)
+            lines = [f'{"":20}' + ''.join(f'{"p" + str(q):>8}' for q in PERCENTILES)]
+            for key, values in self.percentiles().items():
+                lines.append(f'{key:20}' + ''.join(f'{values["p" + str(q)]:8.2f}'
+                                                  for q in PERCENTILES))
+            rows = [font.render(line, True, ScreenEngine.colors["white"]) for line in lines]
+            width = max(row.get_width() for row in rows) + 10
+            self.overlay_surface = pygame.Surface((width, 14 * len(rows) + 10))
+            for i, row in enumerate(rows):
+                self.overlay_surface.blit(row, (5, 5 + 14 * i))
+        return [canvas.blit(self.overlay_surface, (0, 0))]
+
+
+class StartupReport:
+    """ Wall time of startup phases, phase(name) closes the phase which
+    started at the previous call or at `start`."""
+
+    def __init__(self, start=None):
+        self.last = time.perf_counter() if start is None else start
+        self.start = self.last
+        self.phases = []
+
+    def phase(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        lines = [f'{name:20}{elapsed * 1e3:10.1f} ms' for name, elapsed in self.phases]
+        lines.append(f'{"startup":20}{(self.last - self.start) * 1e3:10.1f} ms')
+        return '\n'.join(lines)
+
+
+class NullProfiler:
+    ''' Does nothing, used when profiling is off.'''
+
+    overlay = False
+
+    def attach(self, drawer):
+        pass
+
+    def start(self, stage):
+        pass
+
+    def stop(self, stage):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def draw_overlay(self, canvas):
+        return []
+
+    def dump(self, path):
+        pass
@@ -0,0 +1,188 @@
+import argparse
+import os
+import random
+import struct
+import time
+import numpy as np
+
+from models import Environment
+
+# Commands of a session, moves are ordered as Environment.ACTIONS
+MOVE_RIGHT, MOVE_LEFT, MOVE_UP, MOVE_DOWN, ZOOM_IN, ZOOM_OUT, RESTART, HELP = range(8)
+
+# Log file: magic, version, sprite size, session seed, number of commands,
+# then commands packed two per byte
+MAGIC = b'DKLG'
+VERSION = 1
+HEADER = struct.Struct('<4sBHQI')
+
+
+def pack(commands):
+    codes = np.frombuffer(bytes(commands), dtype=np.uint8)
+    if len(codes) % 2:
+        codes = np.append(codes, np.uint8(0))
+    return (codes[0::2] | codes[1::2] << 4).tobytes()
+
+
+def unpack(data, count):
+    packed = np.frombuffer(data, dtype=np.uint8)
+    codes = np.empty(2 * len(packed), dtype=np.uint8)
+    codes[0::2] = packed & 0xF
+    codes[1::2] = packed >> 4
+    return codes[:count]
+
+
+def save_log(path, seed, sprite_size, commands):
+    with open(path, 'wb') as log:
+        log.write(HEADER.pack(MAGIC, VERSION, sprite_size, seed, len(commands)))
+        log.write(pack(commands))
+
+
+def load_log(path):
+    ''' Returns seed, sprite size and commands of a log file.'''
+    with open(path, 'rb') as log:
+        data = log.read()
+    magic, version, sprite_size, seed, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not an action log of version {VERSION}")
+    return seed, sprite_size, unpack(data[HEADER.size:], count)
+
+
+class Session:
+    """ Games played by commands, as Main.py plays them by keys.
+
+    Every game of the session gets its seed from the session seed, so
+    the seed and the applied commands are enough to play it again.
+    Commands are recorded in `commands`, see save().
+    """
+
+    def __init__(self, seed=None, sprite_size=60, base_stats=None, pool_depth=0):
+        if seed is None:
+            seed = random.randrange(2**64)
+        self.seed = seed
+        self.start_size = sprite_size
+        self.sprite_size = sprite_size
+        self.facing = 'Hero_right.png'
+        self.rng = random.Random(seed)
+        self.env = Environment.GameEnvironment(base_stats, pool_depth=pool_depth)
+        self.commands = bytearray()
+        self.games = 0
+        self.next_seed = self.rng.randrange(2**32)
+        self.new_game()
+
+    @property
+    def engine(self):
+        return self.env.engine
+
+    def new_game(self):
+        self.env.reset(self.next_seed)
+        self.games += 1
+        # First level of the next game is made while this one is played
+        self.next_seed = self.rng.randrange(2**32)
+        self.env.prefetch(self.next_seed)
+
+    def apply(self, command):
+        ''' Runs command and records it.'''
+        self.commands.append(command)
+        engine = self.env.engine
+        if command == HELP:
+            engine.show_help = not engine.show_help
+        elif command == ZOOM_IN:
+            if 640 // self.sprite_size > 5:
+                self.sprite_size += 2
+            else:
+                engine.notify('Min Size reached')
+        elif command == ZOOM_OUT:
+            if 640 // self.sprite_size < 30:
+                self.sprite_size -= 2
+            else:
+                engine.notify('Max Size reached')
+        elif command == RESTART:
+            self.new_game()
+        elif engine.game_process:
+            getattr(engine, Environment.ACTIONS[command])()
+            if command == MOVE_LEFT:
+                self.facing = 'Hero_left.png'
+            elif command == MOVE_RIGHT:
+                self.facing = 'Hero_right.png'
+
+    def save(self, path):
+        save_log(path, self.seed, self.start_size, self.commands)
+
+
+def replay(path, frames=(), output=None):
+    ''' Plays a log without display as fast as possible.
+
+    State after every command number in frames (0 is the start, negative
+    numbers count from the end) is rendered to PNG files in output
+    directory. Returns the session.'''
+    seed, sprite_size, commands = load_log(path)
+    frames = {frame % (len(commands) + 1) for frame in frames}
+    session = Session(seed, sprite_size)
+    if frames:
+        painter = FramePainter(session)
+        os.makedirs(output, exist_ok=True)
+    for i, command in enumerate(commands):
+        if i in frames:
+            painter.save(os.path.join(output, f'frame_{i:06d}.png'))
+        session.apply(int(command))
+    if len(commands) in frames:
+        painter.save(os.path.join(output, f'frame_{len(commands):06d}.png'))
+    return session
+
+
+class FramePainter:
+    ''' Renders the screen of a session with the drawing chain of Main.py.'''
+
+    def __init__(self, session):
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+        from models import ScreenEngine as SE
+
+        self.pygame = pygame
+        self.session = session
+        pygame.init()
+        self.canvas = pygame.display.set_mode((800, 600))
+        self.drawer = SE.GameSurface((640, 480), pygame.SRCALPHA, (0, 480),
+                                     SE.ProgressBar((640, 120), (640, 0),
+                                                    SE.InfoWindow((160, 600), (50, 50),
+                                                                  SE.HelpWindow((700, 500), pygame.SRCALPHA, (0, 0),
+                                                                                SE.ScreenHandle((0, 0))))))
+
+    def save(self, path):
+        from models import Service
+
+        session = self.session
+        engine = session.engine
+        engine.sprite_size = session.sprite_size
+        Service.load_textures(session.sprite_size)
+        engine.hero.sprite = Service.create_sprite(
+            os.path.join("texture", session.facing), session.sprite_size)
+        self.drawer.connect_engine(engine)
+        self.drawer.invalidate()
+        self.drawer.compose(self.canvas)
+        self.pygame.image.save(self.canvas, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay action logs without display")
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--frames", type=int, nargs="*", default=[],
+                        help="command numbers to render, -1 is the end")
+    parser.add_argument("--output", default="frames")
+    args = parser.parse_args()
+
+    for path in args.logs:
+        start = time.perf_counter()
+        output = args.output
+        if len(args.logs) > 1:
+            output = os.path.join(output, os.path.splitext(os.path.basename(path))[0])
+        session = replay(path, args.frames, output)
+        elapsed = time.perf_counter() - start
+        print(f"{path}: {len(session.commands)} commands, {session.games} games, "
+              f"floor {session.engine.level}, score {session.engine.score:.2f}, "
+              f"{elapsed:.3f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import multiprocessing
+import os
+import random
+import numpy as np
+
+from models import Environment
+
+
+def random_policy(observation, rng):
+    return rng.randrange(len(Environment.ACTIONS))
+
+
+def init_worker(max_steps):
+    # Workers are spawned, so none of them inherits SDL state of the parent
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    global env
+    env = Environment.GameEnvironment(max_steps=max_steps, pool_depth=2)
+
+
+def run_episode(seed, policy, next_seed=None):
+    observation = env.reset(seed)
+    # Asked after reset, so the pool does not drop it for levels of this game
+    if next_seed is not None:
+        env.prefetch(next_seed)
+    # Policy gets its own generator, so an episode depends only on its seed
+    rng = random.Random(seed)
+    actions, rewards, dones = [], [], []
+    done = False
+    while not done:
+        action = policy(observation, rng)
+        observation, reward, done, info = env.step(action)
+        actions.append(action)
+        rewards.append(reward)
+        dones.append(done)
+    return {'seed': seed,
+            'actions': np.array(actions, dtype=np.int8),
+            'rewards': np.array(rewards, dtype=np.float32),
+            'dones': np.array(dones, dtype=bool),
+            'score': env.engine.score,
+            'level': env.engine.level}
+
+
+def run_batch(task):
+    seeds, policy = task
+    trajectories = []
+    for i, seed in enumerate(seeds):
+        next_seed = seeds[i + 1] if i + 1 < len(seeds) else None
+        trajectories.append(run_episode(seed, policy, next_seed))
+    return trajectories
+
+
+class RolloutRunner:
+    """ Runs episodes of GameEnvironment in a pool of worker processes.
+
+    Policy has to be picklable (a module level function or object), it
+    gets an observation and a random.Random seeded with the episode seed
+    and returns index of Environment.ACTIONS.
+    """
+
+    def __init__(self, policy=random_policy, processes=None, max_steps=1000):
+        self.policy = policy
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(processes, initializer=init_worker,
+                                 initargs=(max_steps,))
+
+    def run(self, seeds, batch_size=16):
+        ''' Yields lists of trajectories, one list per batch of seeds.'''
+        seeds = list(seeds)
+        tasks = [(seeds[i:i + batch_size], self.policy)
+                 for i in range(0, len(seeds), batch_size)]
+        for batch in self.pool.imap_unordered(run_batch, tasks):
+            yield batch
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel random rollouts")
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-steps", type=int, default=1000)
+    args = parser.parse_args()
+
+    episodes = steps = 0
+    with RolloutRunner(processes=args.processes, max_steps=args.max_steps) as runner:
+        for batch in runner.run(range(args.episodes), args.batch_size):
+            episodes += len(batch)
+            steps += sum(len(trajectory['actions']) for trajectory in batch)
+            mean_score = np.mean([trajectory['score'] for trajectory in batch])
+            print(f"{episodes} episodes, {steps} steps, mean score {mean_score:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import pygame
 import collections
 
+from models import Service
+
 colors = {
     "black": (0, 0, 0, 255),
     "white": (255, 255, 255, 255),
@@ -10,6 +12,23 @@ colors = {
     "wooden": (153, 92, 0, 255),
 }
 
+fonts = {}
+
+
+def get_font(name, size):
+    ''' SysFont looks fonts up in the system, so each one is resolved once.'''
+    key = (name, size)
+    if key not in fonts:
+        if not fonts:
+            # Fonts are freed by pygame.quit(), the cache must go with them
+            pygame.register_quit(fonts.clear)
+        fonts[key] = pygame.font.SysFont(name, size)
+    return fonts[key]
+
+
+def render_text(font, text, color):
+    return font.render(text, True, color)
+
 
 def calculate_left_corner(engine, display):
     sprite_size = engine.sprite_size
@@ -22,20 +41,20 @@ def calculate_left_corner(engine, display):
 
     shape_x = width // sprite_size
     shape_y = length // sprite_size
-    map_size = 41
-    if shape_x//2 <= x <= map_size - shape_x//2:
+    map_height, map_width = engine.map.shape
+    if shape_x//2 <= x <= map_width - shape_x//2:
         min_x = x - shape_x//2
     elif x < shape_x//2:
         min_x = 0
-    elif x > map_size - shape_x//2:
-        min_x = map_size - shape_x
+    elif x > map_width - shape_x//2:
+        min_x = map_width - shape_x
 
-    if shape_y//2 <= y <= map_size - shape_y//2:
+    if shape_y//2 <= y <= map_height - shape_y//2:
         min_y = y - shape_y//2
     elif y < shape_y//2:
         min_y = 0
-    elif y > map_size - shape_y//2:
-        min_y = map_size - shape_y
+    elif y > map_height - shape_y//2:
+        min_y = map_height - shape_y
 
     return (min_x, min_y)
 
@@ -53,128 +72,345 @@ class ScreenHandle(pygame.Surface):
         super().__init__(*args, **kwargs)
         self.fill(colors["wooden"])
 
-    def draw(self, canvas):
+    def render(self):
+        ''' Updates content of the surface, returns rects changed in it.'''
+        return []
 
+    def draw(self, canvas):
+        ''' Renders and blits next surfaces in chain, returns dirty rects.'''
+        rects = []
         if self.successor is not None:
+            changed = self.successor.render()
             canvas.blit(self.successor, self.next_coord)
-            self.successor.draw(canvas)
+            rects.extend(rect.move(self.next_coord) for rect in changed)
+            rects.extend(self.successor.draw(canvas))
+        return rects
+
+    def invalidate(self):
+        ''' Makes the chain redraw everything at the next render.'''
+        if self.successor is not None:
+            self.successor.invalidate()
+
+    def compose(self, canvas, coord=(0, 0)):
+        ''' Draws the whole chain on canvas, returns dirty rects of canvas.'''
+        rects = [rect.move(coord) for rect in self.render()]
+        canvas.blit(self, coord)
+        return rects + self.draw(canvas)
 
     def connect_engine(self, engine):
         self.game_engine = engine
 
 
+class TerrainChunks:
+    """ Terrain of a map pre-drawn in surfaces of `chunk` x `chunk` tiles.
+
+    Chunks are kept for one map and sprite size, the least recently used
+    are dropped when all of them take more than max_pixels. Chunks around
+    the view are drawn ahead on a worker thread, so after scroll the view
+    is put together from a few ready surfaces.
+    """
+
+    def __init__(self, chunk=16, max_pixels=16 * 2**20):
+        self.chunk = chunk
+        self.max_pixels = max_pixels
+        self.surfaces = collections.OrderedDict()
+        self.pending = {}
+        self.pixels = 0
+        self.game_map = None
+        self.size = None
+        self.tiles = None
+        import concurrent.futures
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def reset(self, game_map, size):
+        ''' Drops chunks if map or sprite size has changed.'''
+        if game_map is self.game_map and size == self.size:
+            return
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        self.surfaces.clear()
+        self.pixels = 0
+        self.game_map = game_map
+        self.size = size
+        self.tiles = list(Service.tile_sprites)
+        # Tile positions in a whole chunk, shared by all of its draws
+        self.positions = [(i * size, j * size)
+                          for j in range(self.chunk) for i in range(self.chunk)]
+
+    def chunks_in(self, x0, y0, x1, y1):
+        ''' Keys (cx, cy) of chunks overlapping tile area, inside of the map.'''
+        height, width = self.game_map.shape
+        chunk = self.chunk
+        return [(cx, cy)
+                for cy in range(max(y0, 0) // chunk, -(-min(y1, height) // chunk))
+                for cx in range(max(x0, 0) // chunk, -(-min(x1, width) // chunk))]
+
+    def window(self, cx, cy):
+        chunk = self.chunk
+        return self.game_map[cy * chunk:(cy + 1) * chunk, cx * chunk:(cx + 1) * chunk]
+
+    @staticmethod
+    def draw_chunk(window, tiles, size, positions):
+        height, width = window.shape
+        if len(positions) != height * width:
+            # Chunk cut by the map edge
+            positions = [(i * size, j * size) for j in range(height) for i in range(width)]
+        surface = pygame.Surface((width * size, height * size))
+        surface.blits(zip(map(tiles.__getitem__, window.ravel().tolist()), positions), False)
+        return surface
+
+    def submit(self, key):
+        # Tiles are read here, maps are not safe to use from the worker
+        self.pending[key] = self.executor.submit(
+            self.draw_chunk, self.window(*key), self.tiles, self.size, self.positions)
+
+    def store(self, key, surface):
+        self.surfaces[key] = surface
+        self.pixels += surface.get_width() * surface.get_height()
+        while self.pixels > self.max_pixels and len(self.surfaces) > 1:
+            evicted = self.surfaces.popitem(last=False)[1]
+            self.pixels -= evicted.get_width() * evicted.get_height()
+
+    def collect(self):
+        ''' Moves chunks drawn by the worker to the cache.'''
+        for key, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[key]
+                if not future.cancelled():
+                    self.store(key, future.result())
+
+    def get(self, cx, cy, block=True):
+        ''' Surface of chunk, drawn now if the worker has not drawn it yet.
+        Without block it is left to the worker and None is returned.'''
+        key = (cx, cy)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        if not block and not (key in self.pending and self.pending[key].done()):
+            if key not in self.pending:
+                self.submit(key)
+            return None
+        future = self.pending.pop(key, None)
+        if future is not None and not future.cancelled():
+            surface = future.result()
+        else:
+            surface = self.draw_chunk(self.window(cx, cy), self.tiles, self.size,
+                                      self.positions)
+        self.store(key, surface)
+        return surface
+
+    def ready(self, keys):
+        return all(key not in self.pending or self.pending[key].done() for key in keys)
+
+    def prefetch(self, keys):
+        ''' Draws chunks of keys ahead on the worker, nearest to the middle
+        of keys first and as many as fit in max_pixels. Pending chunks out
+        of keys are dropped.'''
+        self.collect()
+        if keys:
+            middle_x = sum(cx for cx, cy in keys) / len(keys)
+            middle_y = sum(cy for cx, cy in keys) / len(keys)
+            keys = sorted(keys, key=lambda key: (key[0] - middle_x) ** 2 + (key[1] - middle_y) ** 2)
+            keys = keys[:max(self.max_pixels // (self.chunk * self.size) ** 2, 1)]
+        wanted = set(keys)
+        for key in list(self.pending):
+            if key not in wanted:
+                self.pending.pop(key).cancel()
+        for key in keys:
+            if key not in self.surfaces and key not in self.pending:
+                self.submit(key)
+
+
 class GameSurface(ScreenHandle):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Static terrain of the current view, redrawn on scroll and zoom
+        # from chunks of terrain drawn beforehand
+        self.terrain = pygame.Surface(self.get_size())
+        self.chunks = TerrainChunks()
+        self.terrain_map = None
+        self.terrain_view = None
+        self.drawn_view = None
+        # After zoom chunks of the view are drawn on the worker, the last
+        # view scaled to the new size stands in for the missing ones
+        self.stand_ins = False
+        self.waiting = []
+        # Sprites drawn at the last frame by tile position
+        self.entities = {}
+
     def connect_engine(self, engine):
         # FIXME save engine and send it to next in chain
         # Done
         self.game_engine = engine
         self.successor.connect_engine(engine)
 
+    def invalidate(self):
+        self.terrain_view = None
+        super().invalidate()
+
     def draw_hero(self):
-        self.game_engine.hero.draw(self)
+        return self.game_engine.hero.draw(self)
 
-    def draw_map(self):
+    def visible_area(self):
+        ''' Tile bounds (x0, y0, x1, y1) of the viewport with one tile margin.'''
+        size = self.game_engine.sprite_size
         min_x, min_y = calculate_left_corner(self.game_engine, self)
+        width, height = self.get_size()
+        return (min_x - 1, min_y - 1,
+                min_x + -(-width // size) + 1, min_y + -(-height // size) + 1)
 
-        if self.game_engine.map:
-            for i in range(len(self.game_engine.map[0]) - min_x):
-                for j in range(len(self.game_engine.map) - min_y):
-                    self.blit(self.game_engine.map[min_y + j][min_x + i][
-                              0], (i * self.game_engine.sprite_size, j * self.game_engine.sprite_size))
+    def draw_map(self):
+        ''' Draws terrain of the view, returns dirty rects of terrain.'''
+        min_x, min_y = calculate_left_corner(self.game_engine, self)
 
-        else:
-            self.fill(colors["white"])
+        size = self.game_engine.sprite_size
+        chunks = self.chunks
+        old_view = self.drawn_view if chunks.game_map is self.game_engine.map else None
+        zoomed = self.stand_ins and old_view is not None and old_view[2] != size
+        if zoomed:
+            # Scaled before the worker starts, it would hold the GIL
+            old_x, old_y, old_size = old_view
+            width, height = self.terrain.get_size()
+            stand_in = pygame.transform.scale(
+                self.terrain, (width * size // old_size, height * size // old_size))
+        chunks.reset(self.game_engine.map, size)
+        x0, y0, x1, y1 = self.visible_area()
+        self.waiting = []
+        sequence = []
+        for cx, cy in chunks.chunks_in(x0, y0, x1, y1):
+            surface = chunks.get(cx, cy, block=not zoomed)
+            if surface is None:
+                self.waiting.append((cx, cy))
+            else:
+                sequence.append((surface, ((cx * chunks.chunk - min_x) * size,
+                                           (cy * chunks.chunk - min_y) * size)))
+        map_height, map_width = self.game_engine.map.shape
+        width, height = self.terrain.get_size()
+        # Chunks cover only the map, a smaller map leaves the rest of the view
+        beyond = (min_x < 0 or min_y < 0 or (map_width - min_x) * size < width
+                  or (map_height - min_y) * size < height)
+        if self.waiting or beyond:
+            self.terrain.fill(colors["black"])
+        if self.waiting:
+            sequence.insert(0, (stand_in, ((old_x - min_x) * size, (old_y - min_y) * size)))
+        self.drawn_view = (min_x, min_y, size)
+        rects = self.terrain.blits(sequence)
+        # Chunks the view can scroll to next
+        chunks.prefetch(chunks.chunks_in(x0 - chunks.chunk, y0 - chunks.chunk,
+                                         x1 + chunks.chunk, y1 + chunks.chunk))
+        return rects
 
     def draw_object(self, sprite, coord):
         size = self.game_engine.sprite_size
         min_x, min_y = calculate_left_corner(self.game_engine, self)
 
-        self.blit(sprite, ((coord[0] - min_x) * size,
-                           (coord[1] - min_y) * size))
+        return self.blit(sprite, ((coord[0] - min_x) * size,
+                                  (coord[1] - min_y) * size))
 
-    def draw(self, canvas):
-        size = self.game_engine.sprite_size
-        min_x, min_y = calculate_left_corner(self.game_engine, self)
-
-        self.draw_map()
-        for obj in self.game_engine.objects:
-            self.blit(obj.sprite[0], ((obj.position[0] - min_x) * self.game_engine.sprite_size,
-                                      (obj.position[1] - min_y) * self.game_engine.sprite_size))
-        self.draw_hero()
+    def render(self):
+        engine = self.game_engine
+        if engine.map is None:
+            self.terrain_map = None
+            self.fill(colors["white"])
+            return [self.get_rect()]
+
+        size = engine.sprite_size
+        min_x, min_y = calculate_left_corner(engine, self)
+        x0, y0, x1, y1 = self.visible_area()
+        objects = engine.objects_in(x0, y0, x1, y1)
+        entities = {}
+        for obj in objects:
+            entities[tuple(obj.position)] = obj.sprite[0]
+        entities[tuple(engine.hero.position)] = engine.hero.sprite
+
+        view = (min_x, min_y, size)
+        if (engine.map is not self.terrain_map or view != self.terrain_view
+                or self.waiting and self.chunks.ready(self.waiting)):
+            self.terrain_map = engine.map
+            self.terrain_view = view
+            self.draw_map()
+            rects = [self.get_rect()]
+        else:
+            rects = [pygame.Rect((x - min_x) * size, (y - min_y) * size, size, size)
+                     for x, y in set(entities) | set(self.entities)
+                     if entities.get((x, y)) is not self.entities.get((x, y))]
+        self.entities = entities
+        if not rects:
+            return rects
 
-    # draw next surface in chain
-        if self.successor is not None:
-            canvas.blit(self.successor, self.next_coord)
-            self.successor.draw(canvas)
+        self.blit(self.terrain, (0, 0))
+        # Sprites are opaque, the hero hides an object on its tile
+        self.blits([(sprite, ((x - min_x) * size, (y - min_y) * size))
+                    for (x, y), sprite in entities.items()], False)
+        return rects
 
 
 class ProgressBar(ScreenHandle):
 
+    labels = [('HP', (10, 30)), ('Exp', (10, 70)),
+              ('Level', (300, 30)), ('Gold', (300, 70)),
+              ('Str', (420, 30)), ('Luck', (420, 70)),
+              ('SCORE', (550, 30))]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fill(colors["wooden"])
+        self.drawn_state = None
+        self.font = get_font("comicsansms", 20)
+        # Panel with frames and labels, values are drawn over it
+        self.background = pygame.Surface(self.get_size(), 0, self)
+        self.background.fill(colors["wooden"])
+        pygame.draw.rect(self.background, colors["black"], (50, 30, 200, 30), 2)
+        pygame.draw.rect(self.background, colors["black"], (50, 70, 200, 30), 2)
+        for text, coord in self.labels:
+            self.background.blit(render_text(self.font, text, colors["black"]), coord)
+        # Rendered value texts by their position
+        self.values = {}
 
     def connect_engine(self, engine):
         self.engine = engine
         self.successor.connect_engine(engine)
 
-    def draw(self, canvas):
-        self.fill(colors["wooden"])
-        pygame.draw.rect(self, colors["black"], (50, 30, 200, 30), 2)
-        pygame.draw.rect(self, colors["black"], (50, 70, 200, 30), 2)
-
-        pygame.draw.rect(self, colors[
-                         "red"], (50, 30, 200 * self.engine.hero.hp / self.engine.hero.max_hp, 30))
+    def invalidate(self):
+        self.drawn_state = None
+        super().invalidate()
+
+    def draw_value(self, text, coord):
+        ''' Blits text, rendering it again only if it has changed.'''
+        cached = self.values.get(coord)
+        if cached is None or cached[0] != text:
+            cached = (text, render_text(self.font, text, colors["black"]))
+            self.values[coord] = cached
+        self.blit(cached[1], coord)
+
+    def render(self):
+        hero = self.engine.hero
+        state = (tuple(hero.position), self.engine.level, hero.hp, hero.max_hp,
+                 hero.exp, hero.level, hero.gold, hero.stats["strength"],
+                 hero.stats["luck"], self.engine.score)
+        if state == self.drawn_state:
+            return []
+        self.drawn_state = state
+
+        self.blit(self.background, (0, 0))
+        pygame.draw.rect(self, colors["red"], (50, 30, 200 * hero.hp / hero.max_hp, 30))
         pygame.draw.rect(self, colors["green"], (50, 70,
-                                                 200 * self.engine.hero.exp / (100 * (2**(self.engine.hero.level - 1))), 30))
-
-        font = pygame.font.SysFont("comicsansms", 20)
-        self.blit(font.render(f'Hero at {self.engine.hero.position}', True, colors["black"]),
-                  (250, 0))
-
-        self.blit(font.render(f'{self.engine.level} floor', True, colors["black"]),
-                  (10, 0))
-
-        self.blit(font.render(f'HP', True, colors["black"]),
-                  (10, 30))
-        self.blit(font.render(f'Exp', True, colors["black"]),
-                  (10, 70))
-
-        self.blit(font.render(f'{self.engine.hero.hp}/{self.engine.hero.max_hp}', True, colors["black"]),
-                  (60, 30))
-        self.blit(font.render(f'{self.engine.hero.exp}/{(100*(2**(self.engine.hero.level-1)))}', True, colors["black"]),
-                  (60, 70))
-
-        self.blit(font.render(f'Level', True, colors["black"]),
-                  (300, 30))
-        self.blit(font.render(f'Gold', True, colors["black"]),
-                  (300, 70))
-
-        self.blit(font.render(f'{self.engine.hero.level}', True, colors["black"]),
-                  (360, 30))
-        self.blit(font.render(f'{self.engine.hero.gold}', True, colors["black"]),
-                  (360, 70))
-
-        self.blit(font.render(f'Str', True, colors["black"]),
-                  (420, 30))
-        self.blit(font.render(f'Luck', True, colors["black"]),
-                  (420, 70))
-
-        self.blit(font.render(f'{self.engine.hero.stats["strength"]}', True, colors["black"]),
-                  (480, 30))
-        self.blit(font.render(f'{self.engine.hero.stats["luck"]}', True, colors["black"]),
-                  (480, 70))
-
-        self.blit(font.render(f'SCORE', True, colors["black"]),
-                  (550, 30))
-        self.blit(font.render(f'{self.engine.score:.4f}', True, colors["black"]),
-                  (550, 70))
-
-    # draw next surface in chain
-        if self.successor is not None:
-            canvas.blit(self.successor, self.next_coord)
-            self.successor.draw(canvas)
+                                                 200 * hero.exp / (100 * (2**(hero.level - 1))), 30))
+
+        self.draw_value(f'Hero at {hero.position}', (250, 0))
+        self.draw_value(f'{self.engine.level} floor', (10, 0))
+        self.draw_value(f'{hero.hp}/{hero.max_hp}', (60, 30))
+        self.draw_value(f'{hero.exp}/{(100*(2**(hero.level-1)))}', (60, 70))
+        self.draw_value(f'{hero.level}', (360, 30))
+        self.draw_value(f'{hero.gold}', (360, 70))
+        self.draw_value(f'{hero.stats["strength"]}', (480, 30))
+        self.draw_value(f'{hero.stats["luck"]}', (480, 70))
+        self.draw_value(f'{self.engine.score:.4f}', (550, 70))
+        return [self.get_rect()]
 
 
 class InfoWindow(ScreenHandle):
@@ -184,23 +420,34 @@ class InfoWindow(ScreenHandle):
         self.len = 30
         clear = []
         self.data = collections.deque(clear, maxlen=self.len)
+        self.version = 0
+        self.drawn_version = None
+        # Rendered lines of data, only new messages are rendered
+        self.lines = collections.deque(clear, maxlen=self.len)
+        self.positions = [(5, 20 + 18 * i) for i in range(self.len)]
 
     def update(self, value):
         self.data.append(f"> {str(value)}")
+        self.version += 1
 
-    def draw(self, canvas):
-        self.fill(colors["wooden"])
-        size = self.get_size()
+    def invalidate(self):
+        self.drawn_version = self.version - len(self.data)
+        self.lines.clear()
+        super().invalidate()
 
-        font = pygame.font.SysFont("comicsansms", 10)
-        for i, text in enumerate(self.data):
-            self.blit(font.render(text, True, colors["black"]),
-                      (5, 20 + 18 * i))
+    def render(self):
+        if self.version == self.drawn_version:
+            return []
+        new = min(self.version - (self.drawn_version or 0), self.len)
+        self.drawn_version = self.version
 
-    # draw next surface in chain
-        if self.successor is not None:
-            canvas.blit(self.successor, self.next_coord)
-            self.successor.draw(canvas)
+        font = get_font("comicsansms", 10)
+        for text in list(self.data)[len(self.data) - new:]:
+            self.lines.append(render_text(font, text, colors["black"]))
+
+        self.fill(colors["wooden"])
+        self.blits(zip(self.lines, self.positions), False)
+        return [self.get_rect()]
 
     def connect_engine(self, engine):
         # chain
@@ -224,29 +471,39 @@ class HelpWindow(ScreenHandle):
         self.data.append(["Num+", "Zoom +"])
         self.data.append(["Num-", "Zoom -"])
         self.data.append([" R ", "Restart Game"])
+        self.drawn_help = None
+        self.rows = None
 
     def connect_engine(self, engine):
         self.game_engine = engine
         self.successor.connect_engine(engine)
 
-    def draw(self, canvas):
+    def invalidate(self):
+        self.drawn_help = None
+        super().invalidate()
+
+    def render(self):
+        if self.game_engine.show_help == self.drawn_help:
+            return []
+        self.drawn_help = self.game_engine.show_help
+
         alpha = 0
         if self.game_engine.show_help:
             alpha = 128
         self.fill((0, 0, 0, alpha))
-        size = self.get_size()
-        font1 = pygame.font.SysFont("courier", 24)
-        font2 = pygame.font.SysFont("serif", 24)
         if self.game_engine.show_help:
+            if self.rows is None:
+                font1 = get_font("courier", 24)
+                font2 = get_font("serif", 24)
+                # Blit sequence of key and action texts of every row
+                self.rows = []
+                for i, text in enumerate(self.data):
+                    self.rows.append((render_text(font1, text[0], (128, 128, 255)),
+                                      (50, 50 + 30 * i)))
+                    self.rows.append((render_text(font2, text[1], (128, 128, 255)),
+                                      (150, 50 + 30 * i)))
             pygame.draw.lines(self, (255, 0, 0, 255), True, [
                               (0, 0), (700, 0), (700, 500), (0, 500)], 5)
-            for i, text in enumerate(self.data):
-                self.blit(font1.render(text[0], True, ((128, 128, 255))),
-                          (50, 50 + 30 * i))
-                self.blit(font2.render(text[1], True, ((128, 128, 255))),
-                          (150, 50 + 30 * i))
+            self.blits(self.rows, False)
 
-    # draw next surface in chain
-        if self.successor is not None:
-            canvas.blit(self.successor, self.next_coord)
-            self.successor.draw(canvas)
+        return [self.get_rect()]
@@ -1,33 +1,122 @@
+import collections
+import functools
+import hashlib
 import os
-import pygame
-import random
-import yaml
+import pickle
+import numpy as np
 
-from models import Objects
+from models import Assets, Chunks, Objects
 
 OBJECT_TEXTURE = os.path.join("texture", "objects")
 ENEMY_TEXTURE = os.path.join("texture", "enemies")
 ALLY_TEXTURE = os.path.join("texture", "ally")
 
+# Maps are uint8 arrays of tile ids
+WALL, FLOOR1, FLOOR2, FLOOR3 = range(4)
+TILE_TEXTURES = ("wall.png", "Ground_1.png", "Ground_2.png", "Ground_3.png")
+FLOORS = np.array([FLOOR1, FLOOR1, FLOOR2, FLOOR3, FLOOR1,
+                   FLOOR2, FLOOR3, FLOOR1, FLOOR2], dtype=np.uint8)
+
+# Sprites of tiles by tile id, filled by load_textures
+tile_sprites = [None] * len(TILE_TEXTURES)
+passable = np.array([False, True, True, True])
+
+# Default (width, height) of generated maps, set by `size` of a level
+MAP_SIZE = (41, 41)
+
+# LevelPool used by reload_game, levels are generated in place without it
+level_pool = None
+
+OBJECTS_FILE = os.path.join("yaml_objects", "objects.yml")
+LEVELS_FILE = os.path.join("yaml_objects", "levels.yml")
+# Compiled config is kept here between runs, bump the version when
+# compile_config changes what it makes
+CONFIG_CACHE = os.path.join(".cache", "config.pickle")
+CONFIG_VERSION = 1
+
+EnemyStats = collections.namedtuple(
+    'EnemyStats', ('strength', 'endurance', 'intelligence', 'luck', 'experience'))
+
 
 def create_sprite(img, sprite_size):
-    icon = pygame.image.load(img).convert_alpha()
-    icon = pygame.transform.scale(icon, (sprite_size, sprite_size))
-    sprite = pygame.Surface((sprite_size, sprite_size), pygame.HWSURFACE)
-    sprite.blit(icon, (0, 0))
-    return sprite
+    return Assets.manager.get_sprite(img, sprite_size)
+
+
+def generate_level(level, rng):
+    ''' Creates new map and objects of given level with Generator rng.'''
+    return level_list[min(level, len(level_list) - 1)].create(rng)
+
+
+def level_rng(seed, level):
+    ''' Generator of level of game with seed, independent of actions.'''
+    return np.random.default_rng([seed, level])
+
+
+class LevelPool:
+    """ Generates upcoming levels on a worker thread.
+
+    Levels are keyed by game seed and level number and are the same as
+    generated in place. At most `depth` levels are kept ready, the oldest
+    ones are dropped. Levels which are not ready are generated by get().
+    get() drops levels of other games asked for before the one it takes,
+    they belong to games which are over.
+    """
+
+    def __init__(self, depth=2):
+        self.depth = depth
+        self.levels = collections.OrderedDict()
+        # Threads are imported only by games which use the pool
+        import concurrent.futures
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def prefetch(self, seed, level):
+        key = (seed, level)
+        if key in self.levels or level >= len(level_list):
+            return
+        self.levels[key] = self.executor.submit(generate_level, level,
+                                                level_rng(seed, level))
+        while len(self.levels) > self.depth:
+            self.levels.popitem(last=False)[1].cancel()
+
+    def get(self, seed, level):
+        if (seed, level) in self.levels:
+            for key in list(self.levels):
+                if key == (seed, level):
+                    break
+                if key[0] != seed:
+                    self.levels.pop(key).cancel()
+        future = self.levels.pop((seed, level), None)
+        if future is None or future.cancelled():
+            return generate_level(level, level_rng(seed, level))
+        return future.result()
+
+    def close(self):
+        for future in self.levels.values():
+            future.cancel()
+        self.levels.clear()
+        self.executor.shutdown(wait=False)
+
+
+def close_level_pool():
+    ''' Stops the shared LevelPool, the next environment with pool_depth
+    makes a new one.'''
+    global level_pool
+    if level_pool is not None:
+        level_pool.close()
+        level_pool = None
 
 
 def reload_game(engine, hero):
-    global level_list
-    level_list_max = len(level_list) - 1
     engine.level += 1
     hero.position = [1, 1]
-    engine.objects = []
-    generator = level_list[min(engine.level, level_list_max)]
-    _map = generator['map'].get_map()
+    if level_pool is None:
+        _map, objects = generate_level(engine.level, engine.level_rng(engine.level))
+    else:
+        _map, objects = level_pool.get(engine.seed, engine.level)
+        level_pool.prefetch(engine.seed, engine.level + 1)
     engine.load_map(_map)
-    engine.add_objects(generator['obj'].get_objects(_map))
+    engine.objects = objects
     engine.add_hero(hero)
 
 
@@ -42,7 +131,7 @@ def apply_blessing(engine, hero):
         engine.score += 0.2
         hero.gold -= int(20 * 1.5**engine.level) - \
             2 * hero.stats["intelligence"]
-        if random.randint(0, 1) == 0:
+        if engine.rng.integers(0, 2) == 0:
             engine.hero = Objects.Blessing(hero)
             engine.notify("Blessing applied")
         else:
@@ -62,29 +151,138 @@ def remove_effect(engine, hero):
 
 
 def add_gold(engine, hero):
-    if random.randint(1, 10) == 1:
+    if engine.rng.integers(1, 11) == 1:
         engine.score -= 0.05
         engine.hero = Objects.Weakness(hero)
         engine.notify("You were cursed")
     else:
         engine.score += 0.1
-        gold = int(random.randint(10, 1000) * (1.1**(engine.hero.level - 1)))
+        gold = int(engine.rng.integers(10, 1001) * (1.1**(engine.hero.level - 1)))
         hero.gold += gold
         engine.notify(f"{gold} gold added")
 
 
-class MapFactory(yaml.YAMLObject):
+ACTIONS = {'reload_game': reload_game,
+           'add_gold': add_gold,
+           'apply_blessing': apply_blessing,
+           'remove_effect': remove_effect,
+           'restore_hp': restore_hp}
+
+
+def reachable_cells(walkable, start):
+    ''' Mask of walkable cells connected with start cell.'''
+    reached = np.zeros_like(walkable)
+    reached[start[1], start[0]] = True
+    while True:
+        grown = reached.copy()
+        grown[1:] |= reached[:-1]
+        grown[:-1] |= reached[1:]
+        grown[:, 1:] |= reached[:, :-1]
+        grown[:, :-1] |= reached[:, 1:]
+        grown &= walkable
+        if (grown == reached).all():
+            return reached
+        reached = grown
+
+
+class ObjectPlacer:
+    """ Samples free walkable cells of a map without replacement.
+
+    Cells are drawn with Generator rng. Start cell of hero is never given
+    out, there is none if start is None. With reachable=True only cells
+    connected with the start cell are used. Placed cells are shifted by
+    offset, for maps which are a part of a bigger map.
+    """
+
+    def __init__(self, _map, rng, start=(1, 1), reachable=False, offset=(0, 0)):
+        self.rng = rng
+        self.offset = offset
+        walkable = passable[_map]
+        if reachable:
+            walkable = reachable_cells(walkable, start)
+        else:
+            walkable = walkable.copy()
+        if start is not None:
+            walkable[start[1], start[0]] = False
+        ys, xs = np.nonzero(walkable)
+        self.cells = np.stack([xs, ys], axis=1)
+        self.free = np.ones(len(self.cells), dtype=bool)
+
+    def place(self, count, area=None):
+        ''' Returns up to count (x, y) free cells, taken from
+        area (x0, y0, x1, y1) first when it is given.'''
+        chosen = []
+        if area is not None:
+            x0, y0, x1, y1 = area
+            xs, ys = self.cells[:, 0], self.cells[:, 1]
+            inside = (x0 <= xs) & (xs <= x1) & (y0 <= ys) & (ys <= y1)
+            chosen.extend(self.take(count, self.free & inside))
+        chosen.extend(self.take(count - len(chosen), self.free))
+        dx, dy = self.offset
+        return [(int(self.cells[i, 0]) + dx, int(self.cells[i, 1]) + dy) for i in chosen]
+
+    def take(self, count, mask):
+        candidates = np.flatnonzero(mask)
+        count = min(count, len(candidates))
+        chosen = self.rng.choice(candidates, count, replace=False)
+        self.free[chosen] = False
+        return chosen
+
+
+def place_allies(placer, group, counts=None):
+    ''' Places given count, or random count of config, of every object
+    of group as Ally.'''
+    objects = []
+    for obj_name in object_list_prob[group]:
+        prop = object_list_prob[group][obj_name]
+        if counts is None:
+            count = placer.rng.integers(prop['min-count'], prop['max-count'] + 1)
+        else:
+            count = counts.get(obj_name, 0)
+        for coord in placer.place(count):
+            objects.append(Objects.Ally(prop['sprite'], prop['action'], coord, obj_name))
+    return objects
+
+
+def place_enemies(placer, counts, area=None):
+    ''' Places given count of every enemy.'''
+    objects = []
+    for enemy_name in counts:
+        sprite = object_list_prob['enemies'][enemy_name]['sprite']
+        record = enemy_stats[enemy_name]
+        for coord in placer.place(counts[enemy_name], area):
+            stats = record._asdict()
+            experience = stats.pop('experience')
+            objects.append(Objects.Enemy(sprite, stats, experience, coord, enemy_name))
+    return objects
+
+
+class MapFactory:
+    """ Level of levels.yml, subclasses are read from tags `yaml_tag`."""
+
+    def __init__(self, config=None):
+        config = dict(config or {})
+        width, height = config.pop('size', MAP_SIZE)
+        self.shape = (height, width)
+        self.config = config
 
     @classmethod
     def from_yaml(cls, loader, node):
-        data = loader.construct_mapping(node)
-        level = cls()
-        if data:
-            _obj = level.Objects(data)
+        data = loader.construct_mapping(node, deep=True)
+        return cls(data)
+
+    def create_objects(self, _map, rng):
+        ''' Places new objects of the level on given map.'''
+        if self.config:
+            _obj = self.Objects(self.config)
         else:
-            _obj = level.Objects()
-        _map = level.Map()
-        return {'map': _map, 'obj': _obj}
+            _obj = self.Objects()
+        return _obj.get_objects(_map, rng)
+
+    def create(self, rng):
+        ''' Generates new map and objects of the level.'''
+        _map = self.Map(rng, self.shape).get_map()
+        return _map, self.create_objects(_map, rng)
 
 
 class EndMap(MapFactory):
@@ -92,7 +290,7 @@ class EndMap(MapFactory):
     yaml_tag = "!end_map"
 
     class Map:
-        def __init__(self):
+        def __init__(self, rng, shape):
             _map = ['00000000000000000000000000000000000000000',
                     '0                                       0',
                     '0                                       0',
@@ -133,12 +331,9 @@ class EndMap(MapFactory):
                     '00000000000000000000000000000000000000000',
                     '00000000000000000000000000000000000000000'
                     ]
-            self.Map = _map
-            self.Map = list(map(list, self.Map))
-            for i in self.Map:
-                for j in range(len(i)):
-                    i[j] = wall if i[j] == '0' else floor1
-         
+            walls = np.array(list(map(list, _map))) == '0'
+            self.Map = np.where(walls, WALL, FLOOR1).astype(np.uint8)
+
         def get_map(self):
             return self.Map
 
@@ -146,7 +341,7 @@ class EndMap(MapFactory):
         def __init__(self):
             self.objects = []
 
-        def get_objects(self, _map):
+        def get_objects(self, _map, rng):
             return self.objects
 
 
@@ -155,15 +350,10 @@ class EmptyMap(MapFactory):
 
     class Map:
 
-        def __init__(self):
-            self.Map = [[0 for _ in range(41)] for _ in range(41)]
-            for i in range(41):
-                for j in range(41):
-                    if i == 0 or j == 0 or i == 40 or j == 40:
-                        self.Map[j][i] = wall
-                    else:
-                        self.Map[j][i] = [floor1, floor1, floor2, floor3, floor1,
-                                          floor2, floor3, floor1, floor2][random.randint(0, 8)]
+        def __init__(self, rng, shape):
+            self.Map = FLOORS[rng.integers(0, len(FLOORS), shape)]
+            self.Map[[0, -1], :] = WALL
+            self.Map[:, [0, -1]] = WALL
 
         def get_map(self):
             return self.Map
@@ -173,27 +363,9 @@ class EmptyMap(MapFactory):
         def __init__(self):
             self.objects = []
 
-        def get_objects(self, _map):
-            for obj_name in object_list_prob['objects']:
-                prop = object_list_prob['objects'][obj_name]
-                for i in range(random.randint(prop['min-count'], prop['max-count'])):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-
-                    self.objects.append(Objects.Ally(
-                        prop['sprite'], prop['action'], coord))
+        def get_objects(self, _map, rng):
+            placer = ObjectPlacer(_map, rng)
+            self.objects.extend(place_allies(placer, 'objects'))
             return self.objects
 
 
@@ -202,15 +374,12 @@ class RandomMap(MapFactory):
 
     class Map:
 
-        def __init__(self):
-            self.Map = [[0 for _ in range(41)] for _ in range(41)]
-            for i in range(41):
-                for j in range(41):
-                    if i == 0 or j == 0 or i == 40 or j == 40:
-                        self.Map[j][i] = wall
-                    else:
-                        self.Map[j][i] = [wall, floor1, floor2, floor3, floor1,
-                                          floor2, floor3, floor1, floor2][random.randint(0, 8)]
+        def __init__(self, rng, shape):
+            tiles = np.array([WALL, FLOOR1, FLOOR2, FLOOR3, FLOOR1,
+                              FLOOR2, FLOOR3, FLOOR1, FLOOR2], dtype=np.uint8)
+            self.Map = tiles[rng.integers(0, len(tiles), shape)]
+            self.Map[[0, -1], :] = WALL
+            self.Map[:, [0, -1]] = WALL
 
         def get_map(self):
             return self.Map
@@ -220,69 +389,17 @@ class RandomMap(MapFactory):
         def __init__(self):
             self.objects = []
 
-        def get_objects(self, _map):
-
-            for obj_name in object_list_prob['objects']:
-                prop = object_list_prob['objects'][obj_name]
-                for i in range(random.randint(prop['min-count'], prop['max-count'])):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-
-                    self.objects.append(Objects.Ally(
-                        prop['sprite'], prop['action'], coord))
-
-            for obj_name in object_list_prob['ally']:
-                prop = object_list_prob['ally'][obj_name]
-                for i in range(random.randint(prop['min-count'], prop['max-count'])):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-                    self.objects.append(Objects.Ally(
-                        prop['sprite'], prop['action'], coord))
-
-            for obj_name in object_list_prob['enemies']:
-                prop = object_list_prob['enemies'][obj_name]
-                for i in range(random.randint(0, 5)):
-                    coord = (random.randint(1, 30), random.randint(1, 22))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-
-                    self.objects.append(Objects.Enemy(
-                        prop['sprite'], prop, prop['experience'], coord))
+        def get_objects(self, _map, rng):
+            # Random walls may cut off parts of the map
+            placer = ObjectPlacer(_map, rng, reachable=True)
+            self.objects.extend(place_allies(placer, 'objects'))
+            self.objects.extend(place_allies(placer, 'ally'))
+            counts = {name: rng.integers(0, 6)
+                      for name in object_list_prob['enemies']}
+            # Enemies are put near the start first
+            height, width = _map.shape
+            area = (1, 1, min(30, width - 2), min(22, height - 2))
+            self.objects.extend(place_enemies(placer, counts, area))
 
             return self.objects
 
@@ -293,7 +410,7 @@ class SpecialMap(MapFactory):
 
     class Map:
 
-        def __init__(self):
+        def __init__(self, rng, shape):
             _map = ['00000000000000000000000000000000000000000',
                     '0                                  0    0',
                     '0        0     0000000000000000    0    0',
@@ -337,15 +454,9 @@ class SpecialMap(MapFactory):
                     '00000000000000000000000000000000000000000'
                     ]
 
-            self.Map = [[0 for _ in range(len(_map[0]))] for _ in range(len(_map))]
-
-            for i in range(len(_map[0])):
-                for j in range(len(_map)):
-                    if _map[j][i] == '0':
-                        self.Map[j][i] = wall
-                    else:
-                        self.Map[j][i] = [floor1, floor1, floor2, floor3, floor1,
-                                          floor2, floor3, floor1, floor2][random.randint(0, 8)]
+            walls = np.array(list(map(list, _map))) == '0'
+            self.Map = FLOORS[rng.integers(0, len(FLOORS), walls.shape)]
+            self.Map[walls] = WALL
 
         def get_map(self):
             return self.Map
@@ -356,129 +467,206 @@ class SpecialMap(MapFactory):
             self.objects = []
             self.config = config
 
-        def get_objects(self, _map):
-            config = self.config.copy()
-            # Place enemies
-            for enemy_name in config:
-                prop = object_list_prob['enemies'][enemy_name]
-                for _ in range(config[enemy_name]):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-
-                    self.objects.append(Objects.Enemy(
-                        prop['sprite'], prop, prop['experience'], coord))
-
-            # Place Allies
-            for obj_name in object_list_prob['ally']:
-                prop = object_list_prob['ally'][obj_name]
-                for i in range(random.randint(prop['min-count'], prop['max-count'])):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-                    self.objects.append(Objects.Ally(
-                        prop['sprite'], prop['action'], coord))
-
-            # Place Chest and Stairs
-            for obj_name in object_list_prob['objects']:
-                prop = object_list_prob['objects'][obj_name]
-                for i in range(random.randint(prop['min-count'], prop['max-count'])):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-                    self.objects.append(Objects.Ally(
-                        prop['sprite'], prop['action'], coord))
+        def get_objects(self, _map, rng):
+            placer = ObjectPlacer(_map, rng)
+            self.objects.extend(place_enemies(placer, self.config))
+            self.objects.extend(place_allies(placer, 'ally'))
+            # Chest and Stairs
+            self.objects.extend(place_allies(placer, 'objects'))
 
             return self.objects
 
-wall = [0]
-floor1 = [0]
-floor2 = [0]
-floor3 = [0]
-
 
-def service_init(sprite_size, full=True):
-    global object_list_prob, level_list
-
-    global wall
-    global floor1
-    global floor2
-    global floor3
-
-    wall[0] = create_sprite(os.path.join("texture", "wall.png"), sprite_size)
-    floor1[0] = create_sprite(os.path.join("texture", "Ground_1.png"), sprite_size)
-    floor2[0] = create_sprite(os.path.join("texture", "Ground_2.png"), sprite_size)
-    floor3[0] = create_sprite(os.path.join("texture", "Ground_3.png"), sprite_size)
+class OpenMap(MapFactory):
+    """ Big open map of random floors and walls, made of chunks on demand.
+
+    Options: size [width, height], chunk (side of chunk in tiles),
+    max-chunks (chunks kept in memory), walls (share of wall tiles) and
+    per-chunk (mean count of every enemy, ally and object in a chunk).
+    Tiles and objects of a chunk depend only on the level seed and the
+    chunk, so evicted chunks come back the same.
+    """
+    yaml_tag = "!open_map"
+
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.chunk_size = self.config.pop('chunk', 64)
+        self.max_chunks = self.config.pop('max-chunks', 64)
+        self.walls = self.config.pop('walls', 0.1)
+        self.counts = self.config.pop('per-chunk', {})
+
+    def create(self, rng):
+        seed = int(rng.integers(2**63))
+        _map = Chunks.ChunkedMap(self.shape, self.chunk_size,
+                                 functools.partial(self.chunk_tiles, seed),
+                                 functools.partial(self.chunk_objects, seed),
+                                 self.max_chunks)
+        return _map, []
+
+    def chunk_tiles(self, seed, cx, cy):
+        size = self.chunk_size
+        rng = np.random.default_rng([seed, cx, cy])
+        tiles = FLOORS[rng.integers(0, len(FLOORS), (size, size))]
+        tiles[rng.random((size, size)) < self.walls] = WALL
+        height, width = self.shape
+        ys = np.arange(cy * size, (cy + 1) * size)
+        xs = np.arange(cx * size, (cx + 1) * size)
+        tiles[(ys == 0) | (ys >= height - 1)] = WALL
+        tiles[:, (xs == 0) | (xs >= width - 1)] = WALL
+        if (cx, cy) == (0, 0):
+            tiles[1, 1] = FLOOR1
+        return tiles
+
+    def chunk_objects(self, seed, cx, cy, tiles):
+        rng = np.random.default_rng([seed, cx, cy, 1])
+        start = (1, 1) if (cx, cy) == (0, 0) else None
+        placer = ObjectPlacer(tiles, rng, start,
+                              offset=(cx * self.chunk_size, cy * self.chunk_size))
+        counts = {name: rng.poisson(mean) for name, mean in self.counts.items()}
+        enemies = {name: counts[name] for name in counts
+                   if name in object_list_prob['enemies']}
+        objects = place_enemies(placer, enemies)
+        objects.extend(place_allies(placer, 'ally', counts))
+        objects.extend(place_allies(placer, 'objects', counts))
+        return objects
+
+
+def load_textures(sprite_size):
+    ''' Loads tile sprites of given size. Object sprites are loaded at
+    their first draw.'''
+    for tile, texture in enumerate(TILE_TEXTURES):
+        tile_sprites[tile] = create_sprite(os.path.join("texture", texture), sprite_size)
+
+    for group in ('objects', 'ally', 'enemies'):
+        for name in object_list_prob[group]:
+            prop = object_list_prob[group][name]
+            prop['sprite'].resize(sprite_size)
+
+
+def check_config(objects, levels):
+    ''' Raises ValueError naming the first wrong entry of config files.'''
+    for group in ('objects', 'ally', 'enemies'):
+        if not isinstance(objects.get(group), dict):
+            raise ValueError(f"{OBJECTS_FILE}: group {group} is missing")
+        for name, prop in objects[group].items():
+            where = f"{OBJECTS_FILE}: {group}/{name}"
+            sprite = prop.get('sprite')
+            if not isinstance(sprite, list) or not sprite or not isinstance(sprite[0], str):
+                raise ValueError(f"{where}: sprite has to be a list with a file name")
+            if group == 'enemies':
+                fields = EnemyStats._fields
+            else:
+                fields = ('min-count', 'max-count')
+                if prop.get('action') not in ACTIONS:
+                    raise ValueError(f"{where}: unknown action {prop.get('action')!r}")
+            for field in fields:
+                if not isinstance(prop.get(field), int):
+                    raise ValueError(f"{where}: {field} has to be an integer")
+            if group != 'enemies' and prop['min-count'] > prop['max-count']:
+                raise ValueError(f"{where}: min-count is greater than max-count")
+
+    names = set(objects['objects']) | set(objects['ally']) | set(objects['enemies'])
+    for i, level in enumerate(levels):
+        if not isinstance(level, MapFactory):
+            raise ValueError(f"{LEVELS_FILE}: level {i} is not a map tag")
+        if isinstance(level, SpecialMap):
+            unknown = set(level.config) - set(objects['enemies'])
+        elif isinstance(level, OpenMap):
+            unknown = set(level.counts) - names
+        else:
+            unknown = set()
+        if unknown:
+            raise ValueError(f"{LEVELS_FILE}: level {i} has unknown objects {sorted(unknown)}")
+
+
+def config_loader():
+    ''' Safe YAML loader with level tags, uses libyaml if installed.'''
+    # yaml is imported only when the config cache is outdated
+    import yaml
+
+    class ConfigLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+        pass
+
+    factories = MapFactory.__subclasses__()
+    while factories:
+        factory = factories.pop()
+        factories.extend(factory.__subclasses__())
+        if getattr(factory, 'yaml_tag', None):
+            ConfigLoader.add_constructor(factory.yaml_tag, factory.from_yaml)
+    return ConfigLoader
+
+
+def compile_config():
+    ''' Parses and checks objects and levels. Actions are kept as names,
+    so the result can be pickled.'''
+    import yaml
+
+    loader = config_loader()
+    with open(OBJECTS_FILE, "rb") as file:
+        objects = yaml.load(file, Loader=loader)
+    with open(LEVELS_FILE, "rb") as file:
+        levels = yaml.load(file, Loader=loader)['levels']
+    check_config(objects, levels)
+
+    for group, texture_dir in (('objects', OBJECT_TEXTURE),
+                               ('ally', ALLY_TEXTURE),
+                               ('enemies', ENEMY_TEXTURE)):
+        for prop in objects[group].values():
+            prop['texture'] = os.path.join(texture_dir, prop['sprite'][0])
+    enemy_stats = {name: EnemyStats(*(prop[field] for field in EnemyStats._fields))
+                   for name, prop in objects['enemies'].items()}
+    return {'objects': objects, 'levels': levels, 'enemy_stats': enemy_stats}
+
+
+def config_key():
+    digest = hashlib.sha1(str(CONFIG_VERSION).encode())
+    for path in (OBJECTS_FILE, LEVELS_FILE):
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def load_config():
+    ''' Compiled config from the disk cache, compiled again when config
+    files or CONFIG_VERSION changed. Every call returns new objects.'''
+    key = config_key()
+    try:
+        with open(CONFIG_CACHE, "rb") as file:
+            if pickle.load(file) == key:
+                return pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+
+    config = compile_config()
+    try:
+        os.makedirs(os.path.dirname(CONFIG_CACHE), exist_ok=True)
+        temp = f"{CONFIG_CACHE}.{os.getpid()}"
+        with open(temp, "wb") as file:
+            pickle.dump(key, file)
+            pickle.dump(config, file)
+        os.replace(temp, CONFIG_CACHE)
+    except OSError:
+        pass
+    return config
 
-    file = open("yaml_objects/objects.yml", "r")
 
-    object_list_tmp = yaml.load(file.read())
-    if full:
-        object_list_prob = object_list_tmp
-
-    object_list_actions = {'reload_game': reload_game,
-                           'add_gold': add_gold,
-                           'apply_blessing': apply_blessing,
-                           'remove_effect': remove_effect,
-                           'restore_hp': restore_hp}
-
-    for obj in object_list_prob['objects']:
-        prop = object_list_prob['objects'][obj]
-        prop_tmp = object_list_tmp['objects'][obj]
-        prop['sprite'][0] = create_sprite(
-            os.path.join(OBJECT_TEXTURE, prop_tmp['sprite'][0]), sprite_size)
-        prop['action'] = object_list_actions[prop_tmp['action']]
-
-    for ally in object_list_prob['ally']:
-        prop = object_list_prob['ally'][ally]
-        prop_tmp = object_list_tmp['ally'][ally]
-        prop['sprite'][0] = create_sprite(
-            os.path.join(ALLY_TEXTURE, prop_tmp['sprite'][0]), sprite_size)
-        prop['action'] = object_list_actions[prop_tmp['action']]
-
-    for enemy in object_list_prob['enemies']:
-        prop = object_list_prob['enemies'][enemy]
-        prop_tmp = object_list_tmp['enemies'][enemy]
-        prop['sprite'][0] = create_sprite(
-            os.path.join(ENEMY_TEXTURE, prop_tmp['sprite'][0]), sprite_size)
-
-    file.close()
+def service_init(sprite_size, full=True):
+    ''' Loads objects and levels. With sprite_size None textures are not
+    loaded, so the game logic can run without a display.'''
+    global object_list_prob, level_list, enemy_stats
 
     if full:
-        file = open("yaml_objects/levels.yml", "r")
-        level_list = yaml.load(file.read())['levels']
-        level_list.append({'map': EndMap.Map(), 'obj': EndMap.Objects()})
-        file.close()
+        config = load_config()
+        object_list_prob = config['objects']
+        enemy_stats = config['enemy_stats']
+        for group in ('objects', 'ally', 'enemies'):
+            for prop in object_list_prob[group].values():
+                prop['sprite'] = Assets.SpriteHolder(prop['texture'])
+                if 'action' in prop:
+                    prop['action'] = ACTIONS[prop['action']]
+
+        level_list = config['levels']
+        level_list.append(EndMap())
+
+    if sprite_size is not None:
+        load_textures(sprite_size)
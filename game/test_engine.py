@@ -0,0 +1,200 @@
+import os
+import numpy as np
+import pytest
+
+from models import Environment, Objects, Replay
+
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(autouse=True)
+def game_dir(monkeypatch):
+    # Config and textures are read relative to the game directory
+    monkeypatch.chdir(GAME_DIR)
+
+
+def hero_chain(hero):
+    ''' Class and stats of the hero and of every effect on it.'''
+    chain = []
+    while True:
+        chain.append((type(hero).__name__, dict(hero.stats)))
+        if not hasattr(hero, 'base'):
+            return chain
+        hero = hero.base
+
+
+def state(engine):
+    ''' Comparable game state of engine.'''
+    hero = engine.hero
+    height, width = engine.map.shape
+    objects = sorted((tuple(obj.position), obj.name)
+                     for obj in engine.objects_in(0, 0, width, height))
+    return {'level': engine.level,
+            'score': engine.score,
+            'working': engine.working,
+            'game_process': engine.game_process,
+            'hero': hero_chain(hero),
+            'position': tuple(hero.position),
+            'hp': (hero.hp, hero.max_hp),
+            'exp': (hero.exp, hero.level, hero.gold),
+            'map': np.asarray(engine.map[0:height, 0:width]).tobytes(),
+            'objects': objects,
+            'rng': engine.rng.bit_generator.state}
+
+
+def actions(count, seed=0):
+    return np.random.default_rng(seed).integers(0, len(Environment.ACTIONS), count)
+
+
+def play(env, moves):
+    ''' Steps env with moves, returns states and observations after each.'''
+    records = []
+    for action in moves:
+        observation, reward, done, info = env.step(action)
+        records.append((state(env.engine), observation['grid'].tobytes(),
+                        observation['stats'].tobytes(), reward))
+        if done:
+            break
+    return records
+
+
+# DETERMINISM
+def test_same_seed_and_actions_give_identical_runs():
+    runs = []
+    for _ in range(2):
+        env = Environment.GameEnvironment()
+        env.reset(1)
+        runs.append(play(env, actions(1500, seed=3)))
+    assert runs[0] == runs[1]
+    # The run goes past the first floor, so level generation is covered
+    assert max(record[0]['level'] for record in runs[0]) > 0
+
+
+def test_different_seeds_give_different_levels():
+    maps = []
+    for seed in (1, 2):
+        env = Environment.GameEnvironment()
+        env.reset(seed)
+        maps.append(state(env.engine)['objects'])
+    assert maps[0] != maps[1]
+
+
+def test_interleaved_engines_are_independent():
+    moves = actions(500)
+    alone = Environment.GameEnvironment()
+    alone.reset(5)
+    expected = play(alone, moves)
+
+    env, other = Environment.GameEnvironment(), Environment.GameEnvironment()
+    env.reset(5)
+    other.reset(6)
+    records = []
+    for action, other_action in zip(moves, actions(len(moves), seed=1)):
+        records.extend(play(env, [action]))
+        play(other, [other_action])
+        if records[-1][0]['working'] is False:
+            break
+    assert records == expected[:len(records)]
+
+
+# ACTION LOGS
+def test_pack_round_trip():
+    rng = np.random.default_rng(0)
+    for count in range(10):
+        commands = rng.integers(0, 8, count).astype(np.uint8)
+        assert list(Replay.unpack(Replay.pack(bytes(commands)), count)) == list(commands)
+
+
+def test_log_round_trip(tmp_path):
+    path = str(tmp_path / 'session.dklog')
+    commands = bytes(range(8)) * 3 + bytes([Replay.HELP])
+    Replay.save_log(path, 2**64 - 1, 42, commands)
+    seed, sprite_size, loaded = Replay.load_log(path)
+    assert (seed, sprite_size, bytes(loaded)) == (2**64 - 1, 42, commands)
+
+
+def test_load_log_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.dklog'
+    path.write_bytes(b'PNG?' + bytes(32))
+    with pytest.raises(ValueError):
+        Replay.load_log(str(path))
+
+
+def test_replay_reproduces_session(tmp_path):
+    session = Replay.Session(seed=3)
+    rng = np.random.default_rng(3)
+    for _ in range(1500):
+        # Mostly moves, with zoom, help and a few restarts
+        command = rng.choice(8, p=[0.23, 0.23, 0.23, 0.23, 0.02, 0.02, 0.01, 0.03])
+        session.apply(int(command))
+    path = str(tmp_path / 'session.dklog')
+    session.save(path)
+
+    replayed = Replay.replay(path)
+    assert bytes(replayed.commands) == bytes(session.commands)
+    assert (replayed.games, replayed.sprite_size, replayed.facing) == \
+        (session.games, session.sprite_size, session.facing)
+    assert state(replayed.engine) == state(session.engine)
+    assert session.games > 1
+
+
+# SNAPSHOTS
+def shared_stats(hero):
+    ''' Whether every effect shares its stats dict with its base.'''
+    shared = []
+    while hasattr(hero, 'base'):
+        shared.append(hero.stats is hero.base.stats)
+        hero = hero.base
+    return shared
+
+
+def test_restore_brings_back_state_and_future():
+    env = Environment.GameEnvironment()
+    env.reset(1)
+    play(env, actions(300, seed=3))
+    snapshot = env.engine.snapshot()
+    saved = state(env.engine)
+
+    moves = actions(1200, seed=4)
+    expected = play(env, moves)
+    assert expected[-1][0] != saved
+
+    for _ in range(2):
+        env.engine.restore(snapshot)
+        assert state(env.engine) == saved
+        # Random generator is restored too, so the same moves replay the same
+        assert play(env, moves) == expected
+
+
+def test_snapshot_keeps_effect_chain():
+    env = Environment.GameEnvironment()
+    env.reset(2)
+    engine = env.engine
+    plain = engine.snapshot()
+    saved = state(engine)
+    engine.hero.stats["strength"] += 10
+    engine.restore(plain)
+    assert state(engine) == saved
+
+    engine.hero = Objects.Weakness(Objects.Blessing(Objects.Berserk(engine.hero)))
+    engine.hero.gold = 40
+    snapshot = engine.snapshot()
+    saved = state(engine)
+    shared = shared_stats(engine.hero)
+
+    # Changes of the live chain do not reach the snapshot
+    engine.hero.stats["strength"] += 10
+    engine.hero.gold += 5
+    engine.hero.position[0] += 1
+    engine.hero = engine.hero.base
+
+    engine.restore(snapshot)
+    assert state(engine) == saved
+    assert shared_stats(engine.hero) == shared
+    assert [name for name, _ in state(engine)['hero']] == \
+        ['Weakness', 'Blessing', 'Berserk', 'Hero']
+
+    # Every restore gives its own copy
+    engine.hero.stats["luck"] += 1
+    engine.restore(snapshot)
+    assert state(engine) == saved